@@ -0,0 +1,50 @@
+"""
+Benchmark hydrating :py:class:`readit.Reading` instances from Mongo
+documents one at a time through :py:meth:`readit.Reading.from_persistence`
+against :py:meth:`readit.Reading.from_persistence_many`.
+
+Usage: ``python benchmarks/hydration.py [documents]``
+
+"""
+import datetime
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from pymongo.objectid import ObjectId
+
+import readit
+import readit.mongo
+
+
+def make_documents(count):
+    when = datetime.datetime(2012, 3, 24, 11, 56, 48)
+    return [{'_id': ObjectId(), 'title': 'Reading {0}'.format(index),
+             'link': 'http://example.com/', 'user_id': '<UserId>',
+             'when': when - datetime.timedelta(minutes=index)}
+            for index in xrange(count)]
+
+
+def main(count=100000):
+    logging.getLogger('readit.mongo').setLevel(logging.INFO)
+    storage = readit.mongo.Storage()
+    documents = make_documents(count)
+
+    def one_at_a_time():
+        return [storage._manufacture_object(readit.Reading, dict(document))
+                for document in documents]
+
+    def bulk():
+        return readit.Reading.from_persistence_many(documents)
+
+    for name, func in [('from_persistence', one_at_a_time),
+                       ('from_persistence_many', bulk)]:
+        elapsed = min(timeit.repeat(func, number=1, repeat=3))
+        print('{0:<22} {1} documents: {2:.3f}s'.format(name, count, elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,70 @@
+"""
+Benchmark encoding the :py:func:`readit.flaskapp.reading_list` payload with
+each installed :py:class:`readit.json_support.JSONBackend` against creating
+a new :py:class:`readit.json_support.JSONEncoder` for every response and
+against assembling the readings from a
+:py:class:`readit.json_support.FragmentCache`.
+
+Usage: ``python benchmarks/json_backends.py [readings] [responses]``
+
+"""
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from pymongo.objectid import ObjectId
+
+import readit
+import readit.json_support
+
+
+def make_payload(count):
+    now = datetime.datetime(2012, 3, 24, 11, 56, 48)
+    readings = []
+    for index in xrange(count):
+        reading = readit.Reading(title='Reading {0}'.format(index),
+                link='http://example.com/readings/{0}'.format(index),
+                when=now - datetime.timedelta(minutes=index))
+        reading.object_id = ObjectId()
+        reading.user_id = '<UserId>'
+        readings.append(reading)
+    with readit.app.test_request_context('/'):
+        readit.app.preprocess_request()
+        return {'actions': readit.app.links, 'readings': readings}
+
+
+def main(reading_count=100, response_count=1000):
+    payload = make_payload(reading_count)
+
+    def encoder_per_response():
+        return readit.json_support.JSONEncoder().encode(payload)
+
+    candidates = [('JSONEncoder per response', encoder_per_response)]
+    for module_name in readit.json_support.BACKENDS:
+        try:
+            backend = readit.json_support.create_backend(module_name)
+        except ImportError:
+            print('{0:<26} not installed'.format(module_name))
+            continue
+        candidates.append((module_name, lambda backend=backend:
+                           backend.encode(payload)))
+
+    cached = readit.json_support.create_backend(
+        fragment_cache=readit.json_support.FragmentCache())
+    others = {'actions': payload['actions']}
+    candidates.append(('json with fragment cache', lambda: ''.join(
+        cached.iterencode_object(others, 'readings', payload['readings'],
+                                 chunk_size=reading_count))))
+
+    for name, func in candidates:
+        elapsed = min(timeit.repeat(func, number=response_count, repeat=3))
+        print('{0:<26} {1} responses of {2} readings: {3:.3f}s'
+              ' ({4:.3f}ms/response)'.format(name, response_count,
+                  reading_count, elapsed, 1000.0 * elapsed / response_count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,49 @@
+"""
+Benchmark producing the :py:attr:`readit.LinkMap.links` dictionary from
+the compiled link table against calling :py:func:`flask.url_for` for every
+advertised link.
+
+Usage: ``python benchmarks/links.py [requests]``
+
+"""
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+import flask
+
+import readit
+
+
+def url_for_each_link(link_map):
+    links = {}
+    for (link_name, link_dict) in link_map._links.iteritems():
+        args = {}
+        if 'session_key' in link_dict['args']:
+            if not flask.g.user.logged_in:
+                continue
+            args['session_key'] = flask.g.user.session_key
+        links[link_name] = link_map.build_link(link_name, **args)
+    return links
+
+
+def main(request_count=10000):
+    app = readit.app
+    with app.test_request_context('/'):
+        app.preprocess_request()
+        flask.g.user = readit.User(str(uuid.uuid4()))
+        assert url_for_each_link(app) == app.links
+        for name, func in [
+                ('url_for per link', lambda: url_for_each_link(app)),
+                ('compiled link table', lambda: app.links)]:
+            elapsed = min(timeit.repeat(func, number=request_count, repeat=3))
+            print('{0:<20} {1} requests: {2:.3f}s ({3:.1f}us/request)'
+                  .format(name, request_count, elapsed,
+                          1e6 * elapsed / request_count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
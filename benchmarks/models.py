@@ -0,0 +1,48 @@
+"""
+Benchmark the memory footprint and construction time of the model
+classes.  :py:class:`readit.Reading` uses ``__slots__``; the comparison
+class is a trivial subclass which brings back the per-instance
+``__dict__`` that it used to have.
+
+Usage: ``python benchmarks/models.py [readings]``
+
+"""
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+import readit
+
+
+class DictReading(readit.Reading):
+    pass
+
+
+def instance_size(instance):
+    size = sys.getsizeof(instance)
+    if hasattr(instance, '__dict__'):
+        size += sys.getsizeof(instance.__dict__)
+    return size
+
+
+def build(cls, count, when):
+    return [cls('Reading {0}'.format(index), 'http://example.com/', when)
+            for index in xrange(count)]
+
+
+def main(count=100000):
+    when = datetime.datetime(2012, 3, 24, 11, 56, 48)
+    for cls in (readit.Reading, DictReading):
+        elapsed = min(timeit.repeat(lambda: build(cls, count, when),
+                                    number=1, repeat=3))
+        size = instance_size(cls('Title', 'http://example.com/', when))
+        print('{0:<12} {1} readings: {2:.3f}s to build, {3} bytes each, '
+              '{4:.1f}MB total'.format(cls.__name__, count, elapsed, size,
+                                       size * count / 1048576.0))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+Benchmark the JSON reading list endpoint against the in-memory storage
+layer so that the Flask, model, and JSON layers are measured without a
+MongoDB deployment.
+
+Usage: ``python benchmarks/readings_list.py [readings] [requests]``
+
+"""
+import datetime
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.path.pardir))
+os.environ['STORAGE_URL'] = 'memory://benchmark'
+
+import readit
+import readit.memory
+
+
+def populate(storage, user_id, count):
+    now = datetime.datetime.utcnow()
+    readings = []
+    for index in xrange(count):
+        reading = readit.Reading(title='Reading {0}'.format(index),
+                link='http://example.com/readings/{0}'.format(index),
+                when=now - datetime.timedelta(minutes=index))
+        reading.user_id = user_id
+        readings.append(reading)
+    storage.save_many('readings', readings)
+
+
+def main(reading_count=10000, request_count=100):
+    session_key, user_id = str(uuid.uuid4()), str(uuid.uuid4())
+    populate(readit.app.storage, user_id, reading_count)
+    client = readit.app.test_client()
+    with client.session_transaction() as session:
+        session['session_key'] = session_key
+        session['user_id'] = user_id
+    url = '/{0}/readings'.format(session_key)
+
+    def fetch():
+        rsp = client.get(url, headers=[('Accept', 'application/json')])
+        assert rsp.status_code == 200
+
+    elapsed = timeit.timeit(fetch, number=request_count)
+    print('{0} requests over {1} readings: {2:.3f}s ({3:.2f}ms/request)'
+          .format(request_count, reading_count, elapsed,
+                  1000.0 * elapsed / request_count))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
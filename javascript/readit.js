@@ -158,26 +158,47 @@
             "Requires a *reading* object that is sent to the server as-is.",
             "Answers by pushing the response onto ``this.readings``.");
 
-        function fetchReadings() {
-            if (!actions['get-readings']) {
-                debugMessage('no get-readings action defined');
-                return;
-            }
+        function fetchPage(link, readings) {
             jQuery.ajax({
-                url: actions['get-readings'].url,
-                type: actions['get-readings'].method,
+                url: link.url,
+                type: link.method,
                 dataType: "json",
                 success: function (data) {
                     debugMessage("success", data);
-                    that.readings = [];
-                    data.readings.forEach(function (r) {
-                        that.readings.push(new Reading(r));
-                    });
-                    that.update();
+                    addPage(data, readings);
                 }
             });
         };
-        that.addMethod("fetchReadings", fetchReadings);
+
+        function addPage(data, readings) {
+            data.readings.forEach(function (r) {
+                readings.push(new Reading(r));
+            });
+            that.readings = readings;
+            that.update();
+            if (data.next) {
+                fetchPage(data.next, readings);
+            }
+        };
+
+        function fetchReadings() {
+            if (!actions['get-readings']) {
+                debugMessage('no get-readings action defined');
+                return;
+            }
+            fetchPage(actions['get-readings'], []);
+        };
+        that.addMethod("fetchReadings", fetchReadings,
+            "Retrieves the reading list following ``next`` links until",
+            "every page has been loaded.");
+
+        function loadReadings(page) {
+            addPage(page, []);
+        };
+        that.addMethod("loadReadings", loadReadings,
+            "Replaces the reading list with a *page* that was embedded in",
+            "the document and then follows its ``next`` link like",
+            "``fetchReadings`` does.");
 
         function createReading(attrs) {
             return new Reading(attrs);
@@ -75,6 +75,51 @@ $(document).ready(function() {
 			"HTTP method matches hypermedia action");
 	});
 
+	test("fetchReadings() follows next links", function() {
+		var r = readit();
+		addAction(r, "get-readings", "GET", "http://fetch/readings");
+		mockedAjax.addResponse(200, "OK", [], {json: {
+			readings: [createJsonRpcReading("1"), createJsonRpcReading("2")],
+			next: {method: "GET", url: "http://fetch/readings?after=2"}
+		}});
+		mockedAjax.addResponse(200, "OK", [], {json: {
+			readings: [createJsonRpcReading("3")]
+		}});
+
+		r.fetchReadings();
+
+		equal(mockedAjax.getUrl(), "http://fetch/readings?after=2",
+			"next link was followed");
+		equal(r.readings.length, 3, "pages were accumulated");
+	});
+
+	test("loadReadings() uses embedded readings", function() {
+		var r = readit();
+		r.loadReadings({
+			readings: [createJsonRpcReading("1"), createJsonRpcReading("2")]
+		});
+
+		ok(!mockedAjax.wasCalled(), "$.ajax was not called");
+		equal(r.readings.length, 2, "readings were loaded");
+		equal(r.readings[1].id, "2");
+	});
+
+	test("loadReadings() follows next links", function() {
+		var r = readit();
+		mockedAjax.addResponse(200, "OK", [], {json: {
+			readings: [createJsonRpcReading("2")]
+		}});
+
+		r.loadReadings({
+			readings: [createJsonRpcReading("1")],
+			next: {method: "GET", url: "http://fetch/readings?after=1"}
+		});
+
+		equal(mockedAjax.getUrl(), "http://fetch/readings?after=1",
+			"next link was followed");
+		equal(r.readings.length, 2, "pages were accumulated");
+	});
+
 	test("fetchReadings() is a no-op without actions", function() {
 		var r = readit();
 		r.fetchReadings();
@@ -0,0 +1,32 @@
+"""
+Maintenance commands that are run outside of the web application.
+
+Usage: ``python manage.py <command>``
+
+``ensure-indexes``
+   create the Mongo indexes declared in
+   :py:attr:`readit.mongo.Storage.INDEXES`.  This is run as part of each
+   deployment so that index builds never happen on the request path.
+
+"""
+import sys
+
+import readit.flaskapp
+import readit.mongo
+
+
+def ensure_indexes(app):
+    storage = readit.mongo.Storage(storage_url=app.config['STORAGE_URL'],
+            logger=app.logger.getChild('storage'))
+    storage.ensure_indexes()
+
+
+COMMANDS = {
+    'ensure-indexes': ensure_indexes,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        sys.stderr.write(__doc__)
+        sys.exit(64)
+    COMMANDS[sys.argv[1]](readit.flaskapp.app)
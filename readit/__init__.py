@@ -1,6 +1,6 @@
 # order is important here
 from .helpers import LinkMap
-from .reading import Reading
+from .reading import Reading, ReadingList
 from .user import User
 
 # flaskapp import required to be last since it depends on
@@ -15,5 +15,5 @@ class MoreThanOneResultError(Exception):
 
 
 __all__ = ['app', 'Application', 'LinkMap', 'MoreThanOneResultError',
-           'Reading', 'User']
+           'Reading', 'ReadingList', 'User']
 
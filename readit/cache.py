@@ -0,0 +1,316 @@
+"""
+Caching Support
+===============
+
+This module contains the caches that keep frequently requested data out
+of the storage layer.  Every cache implements the following simple
+protocol:
+
+ - ``cache.get(key, version=None) -> value or None``
+ - ``cache.put(key, value, version=None)``
+ - ``cache.discard(key)``
+ - ``cache.clear()``
+ - ``cache.stats() -> dict``
+
+A value is only answered by ``get`` when it was stored with the same
+*version*, so callers can compare against a version kept in the storage
+layer to detect changes.  Caches are created from a URL by
+:py:func:`create_cache`:
+
+ - ``memory://`` selects a :py:class:`LRUCache` that lives in the current
+   process.  This is the default.
+ - ``file:///path/to/directory`` selects a :py:class:`FileCache` that is
+   shared by every process on the host that runs as the same user and
+   uses the same directory.  Pointing it at a memory backed file system
+   such as ``/dev/shm`` keeps it off of the disk.  Values stored in a
+   :py:class:`FileCache` are limited to what :py:mod:`json` can represent
+   plus :py:class:`~datetime.datetime` instances.
+
+"""
+from __future__ import with_statement
+
+import collections
+import datetime
+import errno
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+import urlparse
+
+import readit.helpers
+
+
+def create_cache(cache_url, name, max_size=1000, ttl=None):
+    """Create the cache named *name* that is selected by *cache_url*.
+
+    :param cache_url: the URL that selects the cache implementation.  If
+        this is ``None``, then a :py:class:`LRUCache` is created.
+    :param name: identifies the cache.  Caches with different names do not
+        share values.
+    :param max_size: the maximum number of values to hold
+    :param ttl: the number of seconds that values are valid for
+
+    >>> create_cache('memory://', 'readings')
+    <LRUCache readings>
+    >>> create_cache('redis://localhost', 'readings')
+    Traceback (most recent call last):
+        ...
+    ValueError: unsupported cache URL redis://localhost
+    """
+    if not cache_url or cache_url.startswith('memory://'):
+        return LRUCache(max_size=max_size, ttl=ttl, name=name)
+    if cache_url.startswith('file://'):
+        directory = urlparse.urlparse(cache_url).path
+        return FileCache(os.path.join(directory, name), max_size=max_size,
+                ttl=ttl)
+    raise ValueError('unsupported cache URL {0}'.format(cache_url))
+
+
+class LRUCache(object):
+    """I map keys to values for a limited time.
+
+    :param max_size: the maximum number of values that I hold
+    :param ttl: the number of seconds that a value remains valid for.  If
+        this is ``None``, then values only leave when they are evicted or
+        discarded.
+    :param clock: a function that returns the current time in seconds
+
+    >>> cache = LRUCache(max_size=2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None, cache.hits, cache.misses
+    (True, 1, 1)
+
+    Values can be stored with a *version*.  A value is only returned when
+    :py:meth:`get` is called with the same version, which lets callers
+    detect changes that were made by other processes without waiting for
+    the value to expire.
+
+    >>> cache.put('a', 'old', version=1)
+    >>> cache.get('a', version=2) is None, 'a' in cache
+    (True, False)
+    """
+
+    def __init__(self, max_size=1000, ttl=None, clock=time.time, name=None):
+        super(LRUCache, self).__init__()
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        """Answer the value stored for *key* or ``None`` if there is no
+        current value."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                value, entry_version, expires = entry
+                if (entry_version == version and
+                        (expires is None or expires > self.clock())):
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version=None):
+        """Store *value* for *key*, evicting the least recently used value
+        if I am full."""
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, version, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        """Remove the value for *key* if there is one."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Answer a :py:class:`dict` of my size and hit counters."""
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.name)
+
+
+class FileCache(object):
+    """I implement the cache protocol by storing each value as a JSON
+    document in *directory* so that values are shared between processes.
+
+    :param directory: where the values are stored.  It is created with
+        mode ``0700`` if it does not exist.  An existing directory must be
+        owned by the current user and must not be accessible to anyone
+        else.
+    :param max_size: the number of values that I try to keep.  Every
+        :py:attr:`SWEEP_INTERVAL` calls to :py:meth:`put`, the least
+        recently used values beyond this are removed.
+    :param ttl: see :py:class:`LRUCache`
+    :param clock: see :py:class:`LRUCache`
+
+    Values are written to a temporary file and renamed into place, so a
+    reader sees either the old or the new value and never a partial one.
+    Discarding a value removes its file, which makes the invalidation
+    visible to every process immediately.  A value that is stored with a
+    different version is a miss but is left in place since it may have
+    been written by a process that has seen a newer version than the
+    caller.  The hit and miss counters are kept per process.
+
+    :raises: :py:class:`ValueError` if *directory* is not private to the
+        current user
+    """
+
+    SWEEP_INTERVAL = 100
+
+    def __init__(self, directory, max_size=1000, ttl=None, clock=time.time):
+        super(FileCache, self).__init__()
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        try:
+            os.makedirs(directory, 0700)
+        except OSError, exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        status = os.stat(directory)
+        if (not stat.S_ISDIR(status.st_mode) or
+                status.st_uid != os.getuid() or
+                status.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+            raise ValueError('cache directory {0} is not private to the '
+                    'current user'.format(directory))
+
+    def get(self, key, version=None):
+        path = self._path_for(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry_version, expires, value = json.load(entry_file,
+                        object_hook=_decode_value)
+        except IOError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        except (TypeError, ValueError):
+            self._unlink(path)
+        else:
+            if expires is not None and expires <= self.clock():
+                self._unlink(path)
+            elif entry_version == version:
+                self._touch(path)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, version=None):
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as entry_file:
+                json.dump((version, expires, value), entry_file,
+                        default=_encode_value)
+            os.rename(temp_path, self._path_for(key))
+        except:
+            self._unlink(temp_path)
+            raise
+        self._puts += 1
+        if self._puts % self.SWEEP_INTERVAL == 0:
+            self.sweep()
+
+    def discard(self, key):
+        self._unlink(self._path_for(key))
+
+    def clear(self):
+        for path in self._entry_paths():
+            self._unlink(path)
+
+    def sweep(self):
+        """Remove the least recently used values beyond *max_size*."""
+        entries = []
+        for path in self._entry_paths():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort(reverse=True)
+        for mtime, path in entries[self.max_size:]:
+            self._unlink(path)
+
+    def stats(self):
+        return {'size': len(self), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses}
+
+    def __contains__(self, key):
+        return os.path.exists(self._path_for(key))
+
+    def __len__(self):
+        return len(self._entry_paths())
+
+    def __repr__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.directory)
+
+    def _path_for(self, key):
+        return os.path.join(self.directory,
+                hashlib.sha1(key.encode('utf-8') if isinstance(key, unicode)
+                             else str(key)).hexdigest())
+
+    def _entry_paths(self):
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if not name.startswith('.')]
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError, exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+def _encode_value(obj):
+    if isinstance(obj, datetime.datetime):
+        return {'$datetime': obj.isoformat()}
+    raise TypeError('{0!r} cannot be stored in a FileCache'.format(obj))
+
+
+def _decode_value(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return readit.helpers.parse_iso8601(obj['$datetime'])
+    return obj
@@ -25,15 +25,22 @@ Read It Flask Application
 """
 import datetime
 import functools
+import logging
 import os
 
 import flask
 import flask.ext.openid
 import flask.ext.heroku_runner
+import pymongo
+import pymongo.errors
 import werkzeug.exceptions
 
 import readit
+import readit.cache
 import readit.json_support
+import readit.memory
+import readit.mongo
+import readit.unitofwork
 
 
 class UserNotFoundException(werkzeug.exceptions.NotFound):
@@ -61,6 +68,13 @@ class Application(flask.ext.heroku_runner.HerokuApp, readit.LinkMap):
         readit.LinkMap.__init__(self)
         self.config['SECRET_KEY'] = os.urandom(24)
         self.load_configuration()
+        self.storage = self.create_storage()
+        self.json_backend = self.create_json_backend()
+        self.readings_cache = self.create_cache('readings',
+            self.config['READINGS_CACHE_SIZE'],
+            self.config['READINGS_CACHE_TTL'])
+        self.users_cache = self.create_cache('users',
+            self.config['USERS_CACHE_SIZE'], self.config['USERS_CACHE_TTL'])
         self.oid = flask.ext.openid.OpenID(self)
         self.oid.after_login(self._login_succeeded)
         self.oid.errorhandler(self._report_openid_error)
@@ -69,11 +83,117 @@ class Application(flask.ext.heroku_runner.HerokuApp, readit.LinkMap):
         self.config['SESSION_LIFETIME'] = 5 * 60
         self.config['HOST'] = os.environ.get('HOST', '127.0.0.1')
         self.config['PORT'] = os.environ.get('PORT', '5000')
-        self.config['STORAGE_URL'] = os.environ.get('MONGOURL', None)
+        self.config['STORAGE_URL'] = os.environ.get('STORAGE_URL',
+                os.environ.get('MONGOURL', None))
+        for name, convert in [('STORAGE_POOL_SIZE', int),
+                              ('STORAGE_NETWORK_TIMEOUT', float),
+                              ('STORAGE_CONNECT_TIMEOUT', float)]:
+            value = os.environ.get(name, None)
+            self.config[name] = None if value is None else convert(value)
+        self.config['READINGS_PAGE_SIZE'] = int(
+            os.environ.get('READINGS_PAGE_SIZE', '100'))
+        self.config['JSON_BACKEND'] = os.environ.get('JSON_BACKEND', None)
+        self.config['JSON_FRAGMENT_CACHE_SIZE'] = int(
+            os.environ.get('JSON_FRAGMENT_CACHE_SIZE', '10000'))
+        self.config['CACHE_URL'] = os.environ.get('CACHE_URL', None)
+        self.config['CHANGES_RETENTION'] = float(
+            os.environ.get('CHANGES_RETENTION', str(30 * 24 * 60 * 60)))
+        self.config['INLINE_READINGS'] = os.environ.get(
+            'INLINE_READINGS', 'true').lower() in ['true', 't', 'yes', '1']
+        # user documents are not invalidated so their TTL is the bound on
+        # how long a change to one goes unseen
+        for name, ttl in [('READINGS', '300'), ('USERS', '30')]:
+            self.config[name + '_CACHE_SIZE'] = int(
+                os.environ.get(name + '_CACHE_SIZE', '1000'))
+            self.config[name + '_CACHE_TTL'] = float(
+                os.environ.get(name + '_CACHE_TTL', ttl))
         flag = os.environ.get('DEBUG', None)
         if flag is not None:
             self.config['DEBUG'] = flag.lower() in ['true', 't', 'yes', '1']
 
+    def create_storage(self):
+        """Create the :py:class:`readit.mongo.Storage` instance that is
+        shared by every request for the lifetime of the application.
+
+        If the storage URL starts with ``memory://``, then a
+        :py:class:`readit.memory.Storage` instance is created instead.
+        """
+        # self.logger is not used here since creating it installs Flask's
+        # handlers on the shared logger before the configuration is final
+        logger = logging.getLogger(self.logger_name).getChild('storage')
+        storage_class = readit.mongo.Storage
+        if readit.memory.is_memory_url(self.config['STORAGE_URL']):
+            storage_class = readit.memory.Storage
+        return storage_class(
+            storage_url=self.config['STORAGE_URL'],
+            logger=logger,
+            pool_size=self.config['STORAGE_POOL_SIZE'],
+            network_timeout=self.config['STORAGE_NETWORK_TIMEOUT'],
+            connect_timeout=self.config['STORAGE_CONNECT_TIMEOUT'])
+
+    def create_json_backend(self):
+        """Create the :py:class:`readit.json_support.JSONBackend` that is
+        shared by every request.
+
+        Unless ``JSON_FRAGMENT_CACHE_SIZE`` is zero, the backend caches the
+        JSON text of that many readings so that list responses are built
+        by concatenating fragments instead of re-encoding every reading.
+        """
+        fragment_cache = None
+        if self.config['JSON_FRAGMENT_CACHE_SIZE'] > 0:
+            fragment_cache = readit.json_support.FragmentCache(
+                max_size=self.config['JSON_FRAGMENT_CACHE_SIZE'])
+        return readit.json_support.create_backend(
+            self.config['JSON_BACKEND'], fragment_cache=fragment_cache)
+
+    def create_cache(self, name, max_size, ttl):
+        """Create the cache called *name* using the implementation that
+        ``CACHE_URL`` selects.  See :py:func:`readit.cache.create_cache`.
+
+        Each cache holds up to *max_size* values for *ttl* seconds.
+        ``None`` is returned if *max_size* is zero.
+        """
+        if max_size <= 0:
+            return None
+        return readit.cache.create_cache(self.config['CACHE_URL'], name,
+                max_size=max_size, ttl=ttl)
+
+    def find_user(self, email):
+        """Answer the :py:class:`readit.User` with *email* or ``None``.
+
+        Users are kept in :py:attr:`users_cache` so that logging in does
+        not always require a trip to the storage layer.  The cache holds
+        the persisted attributes and a new instance is created from them
+        each time.  The application never writes user documents, so the
+        cache is not invalidated.  Entries expire after ``USERS_CACHE_TTL``
+        seconds, 30 by default, which bounds how long every worker can
+        keep answering a user after a change is made to the ``users``
+        collection directly.
+        """
+        document = None
+        if self.users_cache is not None:
+            document = self.users_cache.get(email)
+        if document is None:
+            user = flask.g.db.retrieve_one('users', email=email,
+                    cls=readit.User)
+            if user is None or self.users_cache is None:
+                return user
+            document = user.to_persistence()
+            document['_id'] = user.user_id
+            self.users_cache.put(email, document)
+        user = readit.User.from_persistence(document)
+        user.object_id = document['_id']
+        return user
+
+    def warm_up(self):
+        """Connect to the storage layer before the first request arrives.
+        Failures are logged instead of raised so that the application can
+        still start while the database is unavailable."""
+        try:
+            self.storage.warm_up()
+        except Exception:
+            self.logger.exception('failed to warm up %s', self.storage)
+
     @property
     def openid(self):
         """The :py:class:`flask.ext.openid.OpenID` instance that is bound to
@@ -82,8 +202,7 @@ class Application(flask.ext.heroku_runner.HerokuApp, readit.LinkMap):
 
     # registered as @openid.after_login
     def _login_succeeded(self, response):
-        result = flask.g.db.retrieve_one('users', email=response.email,
-                cls=readit.User)
+        result = self.find_user(response.email)
         if result:
             flask.g.user = result
             flask.g.user.login(response)
@@ -120,11 +239,55 @@ class Application(flask.ext.heroku_runner.HerokuApp, readit.LinkMap):
         return super(Application, self).get_send_file_max_age(filename)
 
     def jsonify(self, obj):
-        """JSONify an object using the
-        :py:class:`readit.json_support.JSONEncoder` class.
+        """JSONify an object using the application's
+        :py:class:`readit.json_support.JSONBackend`.  The backend is
+        selected by the ``JSON_BACKEND`` environment variable and is shared
+        by every request.
         """
-        encoder = readit.json_support.JSONEncoder()
-        return self.response_class(encoder.encode(obj),
+        return self.response_class(self.json_backend.encode(obj),
+                mimetype='application/json')
+
+    def jsonify_list(self, obj, name, items):
+        """JSONify *obj* with the property *name* set to the array of
+        *items*.  The array is assembled from cached fragments when the
+        backend has a :py:class:`~readit.json_support.FragmentCache`.
+        """
+        return self.response_class(self.encode_list(obj, name, items),
+                mimetype='application/json')
+
+    def encode_list(self, obj, name, items):
+        """Answer the JSON text that :py:meth:`jsonify_list` responds
+        with."""
+        return ''.join(self.json_backend.iterencode_object(obj, name, items,
+                    chunk_size=len(items) or 1))
+
+    def stream_template(self, template_name, **context):
+        """Render *template_name* as a streamed response.
+
+        This is :py:func:`flask.render_template` except that the template
+        is sent as Jinja generates it, so the browser can start fetching
+        the resources named in the ``head`` block before the rest of the
+        document is rendered.  The template is rendered inside of the
+        current request context.
+        """
+        self.update_template_context(context)
+        template = self.jinja_env.get_template(template_name)
+        return self.response_class(
+                flask.stream_with_context(template.stream(context)))
+
+    def stream_json(self, obj, name, items, chunk_size=100):
+        """Stream the JSON representation of *obj* with the property *name*
+        set to the array of *items*.
+
+        The response body is generated by
+        :py:meth:`~readit.json_support.JSONBackend.iterencode_object` as it
+        is sent, so *items* is consumed *chunk_size* elements at a time
+        after the view function returns.  It must not depend on the
+        request context.
+        """
+        return self.response_class(
+                self.json_backend.iterencode_object(obj, name, items,
+                    chunk_size),
                 mimetype='application/json')
 
     def process_response(self, response):
@@ -193,11 +356,23 @@ def initialize_user():
 
 @app.before_request
 def setup_storage():
+    """Make sure that ``flask.g.db`` is a
+    :py:class:`readit.unitofwork.UnitOfWork` for this request."""
     if not hasattr(flask.g, 'db'):
-        import readit.mongo
-        flask.g.db = readit.mongo.Storage(
-            storage_url=app.config['STORAGE_URL'],
-            logger=app.logger.getChild('storage'))
+        flask.g.db = readit.unitofwork.UnitOfWork(app.storage)
+
+
+@app.after_request
+def flush_storage(response):
+    """Write the changes that were queued in ``flask.g.db`` before the
+    response is sent so that failures are reported to the client.
+
+    Nothing is written if the view responded with an error.
+    """
+    db = getattr(flask.g, 'db', None)
+    if db is not None and response.status_code < 400:
+        db.flush()
+    return response
 
 
 @app.route('/')
@@ -260,43 +435,305 @@ def get_links(session_key):
 @app.advertise('get-readings', 'GET')
 @verify_session
 def reading_list(session_key):
-    """Return the list of readings for this session."""
+    """Return the list of readings for this session.
+
+    The JSON representation is paginated.  If there are more readings
+    available, then the response includes a ``next`` link object that
+    retrieves the following page.  If the ``stream`` query parameter is
+    set, then every reading is streamed from the storage layer into the
+    response instead.
+
+    The first page is kept in :py:attr:`Application.readings_cache`
+    along with the readings version that it was retrieved at.  Adding or
+    removing a reading discards it.  Set ``CACHE_URL`` to share the cache
+    between worker processes.
+
+    JSON responses carry an ``ETag`` derived from the user's readings
+    version which is incremented whenever a reading is added or removed
+    and from :py:attr:`~readit.LinkMap.links_digest` since the response
+    includes the advertised links.
+    If the request's ``If-None-Match`` header matches it, then a
+    ``304 Not Modified`` is returned without retrieving any readings.
+
+    Unless ``INLINE_READINGS`` is disabled, the HTML representation
+    embeds the JSON representation of the first page so that the page
+    does not have to request it again after it loads.  The page is
+    retrieved after the head has been sent.  If that fails, then
+    ``null`` is embedded instead and the page requests the readings
+    itself.
+    """
     if readit.helpers.wants_json(flask.request):
-        app.logger.debug('retrieving data from %s for %s',
-                flask.g.db, flask.g.user.user_id)
-        data = flask.g.db.retrieve('readings',
-                user_id=flask.g.user.user_id,
-                cls=readit.Reading)
-        flask.g.user.add_readings(data)
-        return app.jsonify({
-            'actions': app.links, 'readings': flask.g.user.readings})
-    return flask.render_template('list.html', actions=app.links)
+        version, modified = flask.g.db.retrieve_version('versions',
+                flask.g.user.user_id)
+        etag = 'readings-{0}-{1}'.format(version, app.links_digest)
+        if flask.request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+        else:
+            app.logger.debug('retrieving data from %s for %s',
+                    flask.g.db, flask.g.user.user_id)
+            if flask.request.args.get('stream'):
+                response = _stream_readings(version)
+            else:
+                response = app.jsonify_list(
+                        *_page_of_readings(session_key, version))
+        response.set_etag(etag)
+        if modified is not None:
+            response.last_modified = modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Accept')
+        return response
+    after = flask.request.args.get('after')
+    if after is not None:
+        # the status is sent before the readings are retrieved
+        try:
+            readit.mongo.parse_page_cursor(after)
+        except ValueError, exc:
+            raise werkzeug.exceptions.BadRequest(str(exc))
+    initial_readings = None
+    if app.config['INLINE_READINGS']:
+        initial_readings = functools.partial(_initial_readings, session_key)
+    return app.stream_template('list.html', actions=app.links,
+            initial_readings=initial_readings)
+
+
+def _initial_readings(session_key):
+    # called by the template after the status and head have been sent so
+    # a failure cannot be reported and the page fetches the readings
+    try:
+        version, modified = flask.g.db.retrieve_version('versions',
+                flask.g.user.user_id)
+        return _escape_script(app.encode_list(
+                *_page_of_readings(session_key, version)))
+    except Exception:
+        app.logger.exception('failed to embed readings for %s',
+                flask.g.user.user_id)
+        return 'null'
+
+
+_SCRIPT_ESCAPES = [('&', '\\u0026'), ('<', '\\u003c'), ('>', '\\u003e')]
+
+
+def _escape_script(json_text):
+    """Make *json_text* safe to embed in a ``script`` element.
+
+    The characters that can end the element or change how the HTML
+    parser reads it are replaced by JSON escapes.
+
+    >>> print _escape_script('{"title": "</script><!-- & -->"}')
+    {"title": "\\u003c/script\\u003e\\u003c!-- \\u0026 --\\u003e"}
+    """
+    for character, escape in _SCRIPT_ESCAPES:
+        json_text = json_text.replace(character, escape)
+    return json_text
+
+
+def _page_of_readings(session_key, version):
+    """Answer the arguments for :py:meth:`Application.jsonify_list` that
+    represent the requested page of readings."""
+    after = flask.request.args.get('after')
+    cache = app.readings_cache if after is None else None
+    cached = None
+    if cache is not None:
+        cached = cache.get(flask.g.user.user_id, version=version)
+    if cached is None:
+        try:
+            data, next_cursor = flask.g.db.retrieve_page('readings',
+                    app.config['READINGS_PAGE_SIZE'], after=after,
+                    user_id=flask.g.user.user_id, cls=readit.Reading)
+        except ValueError, exc:
+            raise werkzeug.exceptions.BadRequest(str(exc))
+        if cache is not None:
+            cache.put(flask.g.user.user_id,
+                    {'readings': [_cacheable_reading(reading)
+                                  for reading in data],
+                     'next': next_cursor},
+                    version=version)
+    else:
+        data = readit.Reading.from_persistence_many(cached['readings'])
+        next_cursor = cached['next']
+    flask.g.user.add_readings(data)
+    response = {'actions': app.links, 'sync_token': str(version)}
+    if next_cursor is not None:
+        response['next'] = {'method': 'GET',
+                'url': flask.url_for('reading_list',
+                    session_key=session_key, after=next_cursor)}
+    return response, 'readings', flask.g.user.readings
+
+
+def _cacheable_reading(reading):
+    # caches hold plain documents so that they can be shared between
+    # processes and cannot be modified through the instances they answer
+    document = reading.to_persistence()
+    document['_id'] = reading.object_id
+    return document
+
+
+def _stream_readings(version):
+    page_size = app.config['READINGS_PAGE_SIZE']
+    readings = flask.g.db.iter_retrieve('readings',
+            user_id=flask.g.user.user_id, cls=readit.Reading,
+            sort=[('when', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+            batch_size=page_size)
+    return app.stream_json({'actions': app.links, 'sync_token': str(version)},
+            'readings', readings, chunk_size=page_size)
+
+
+@app.route('/<session_key>/readings/changes')
+@app.advertise('get-readings-since', 'GET')
+@verify_session
+def reading_changes(session_key):
+    """Return the readings that changed after a sync token.
+
+    The ``since`` query parameter is the ``sync_token`` from a previous
+    reading list or changes response.  The response contains the readings
+    that were added since then as ``readings``, the IDs of the readings
+    that were removed as ``removed``, and a new ``sync_token``.  The new
+    token is the newest version found in the change log rather than the
+    current version so that a change whose entries are still being
+    written is reported by the next request.
+
+    Changes are kept for ``CHANGES_RETENTION`` seconds.  If some of the
+    changes after ``since`` have been discarded, then the first page of
+    the reading list is returned instead with ``resync`` set to ``true``.
+    """
+    try:
+        since = int(flask.request.args['since'])
+    except KeyError:
+        raise werkzeug.exceptions.BadRequest('since is a required parameter')
+    except ValueError:
+        raise werkzeug.exceptions.BadRequest('invalid sync token')
+    version, modified = flask.g.db.retrieve_version('versions',
+            flask.g.user.user_id)
+    if since < 0 or since > version:
+        raise werkzeug.exceptions.BadRequest('invalid sync token')
+    changes = flask.g.db.retrieve_changes('changes', flask.g.user.user_id,
+            since)
+    if changes is None:
+        response, name, readings = _page_of_readings(session_key, version)
+        response['resync'] = True
+        return app.jsonify_list(response, name, readings)
+    added, removed, latest = changes
+    readings = []
+    if added:
+        readings = flask.g.db.retrieve('readings',
+                user_id=flask.g.user.user_id, cls=readit.Reading,
+                sort=[('when', pymongo.DESCENDING),
+                      ('_id', pymongo.DESCENDING)],
+                _id={'$in': added})
+    return app.jsonify_list({'actions': app.links,
+                             'sync_token': str(latest),
+                             'removed': removed},
+                            'readings', readings)
 
 
 @app.route('/<session_key>/readings', methods=['POST'])
-@app.advertise('add-reading', 'POST')
+@app.advertise(('add-reading', 'POST'), ('add-readings', 'POST'))
 @verify_session
 def add_reading(session_key):
-    data = flask.request.json or flask.request.form
+    """Add a new reading for this session.
+
+    If the request body is a JSON array, then each element is added as a
+    separate reading using a bulk insert.  The response lists the readings
+    that were added as ``new_readings`` and the array index and error
+    message of any that could not be saved as ``failures``.  An empty
+    array adds nothing and answers empty lists.
+    """
+    data = flask.request.json
+    if data is None:
+        data = flask.request.form
+    if isinstance(data, list):
+        return _add_readings(data)
     try:
         app.logger.debug('saving reading to %s for %s',
                 flask.g.db, flask.g.user)
-        reading = readit.Reading(title=data['title'], link=data['link'],
-                when=data.get('when', datetime.datetime.utcnow()),
-                user=flask.g.user)
+        reading = _create_reading(data)
         flask.g.db.save('readings', reading)
+        _readings_changed(added=[reading.object_id])
         return app.jsonify({'actions': app.links, 'new_reading': reading})
     except KeyError, exc:
         raise werkzeug.exceptions.BadRequest(
             '{0} is a required field'.format(exc))
+    except ValueError, exc:
+        raise werkzeug.exceptions.BadRequest(str(exc))
+
+
+def _create_reading(data):
+    return readit.Reading(title=data['title'], link=data['link'],
+            when=data.get('when', datetime.datetime.utcnow()),
+            user=flask.g.user)
+
+
+def _add_readings(data):
+    readings = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise werkzeug.exceptions.BadRequest(
+                'reading {0} is not an object'.format(index))
+        try:
+            readings.append(_create_reading(item))
+        except KeyError, exc:
+            raise werkzeug.exceptions.BadRequest(
+                'reading {0}: {1} is a required field'.format(index, exc))
+        except ValueError, exc:
+            raise werkzeug.exceptions.BadRequest(
+                'reading {0}: {1}'.format(index, exc))
+    failures = []
+    if readings:
+        app.logger.debug('saving %d readings to %s for %s',
+                len(readings), flask.g.db, flask.g.user)
+        failures = flask.g.db.save_many('readings', readings)
+    failed = dict((id(reading), exc) for (reading, exc) in failures)
+    if len(failed) < len(readings):
+        _readings_changed(added=[r.object_id for r in readings
+                                 if id(r) not in failed])
+    return app.jsonify({
+        'actions': app.links,
+        'new_readings': [r for r in readings if id(r) not in failed],
+        'failures': [{'index': index, 'error': str(failed[id(r)])}
+                     for (index, r) in enumerate(readings)
+                     if id(r) in failed],
+    })
 
 
 @app.route('/<session_key>/readings/<reading_id>', methods=['DELETE'])
 def remove_reading(session_key, reading_id):
-    flask.g.db.remove('readings', flask.g.user.user_id, _id=reading_id)
+    try:
+        flask.g.db.remove('readings', reading_id,
+                user_id=flask.g.user.user_id)
+    except pymongo.errors.InvalidId:
+        raise werkzeug.exceptions.NotFound()
+    if app.json_backend.fragment_cache is not None:
+        app.json_backend.fragment_cache.discard(reading_id)
+    _readings_changed(removed=[reading_id])
     return flask.Response(status=204)
 
 
+def _readings_changed(added=(), removed=()):
+    flask.g.db.after_flush(_record_readings_change, flask.g.db,
+            flask.g.user.user_id, added, removed)
+
+
+def _record_readings_change(db, user_id, added, removed):
+    # called once the readings have been written so that a concurrent
+    # request cannot cache the old readings under the new version.  This
+    # also runs when a write failed, so only the readings that actually
+    # changed are recorded.
+    added = [object_id for object_id in added
+             if db.was_written('readings', object_id)]
+    removed = [object_id for object_id in removed
+               if db.was_written('readings', object_id)]
+    if not added and not removed:
+        return
+    if app.readings_cache is not None:
+        app.readings_cache.discard(user_id)
+    version = db.increment_version('versions', user_id)
+    db.record_changes('changes', user_id, version, added=added,
+            removed=removed)
+    db.prune_changes('changes', user_id, datetime.datetime.utcnow() -
+            datetime.timedelta(seconds=app.config['CHANGES_RETENTION']))
+
+
 @app.errorhandler(404)
 def user_not_found_handler(error):
     response = flask.make_response(flask.render_template(
@@ -1,8 +1,11 @@
+import datetime
 import functools
+import hashlib
 import inspect
 import warnings
 
 import flask
+import werkzeug.urls
 
 
 def is_redirect(response):
@@ -18,6 +21,66 @@ def wants_json(request):
     return any(requested.endswith(x) for x in ['/json', '+json'])
 
 
+def parse_iso8601(value):
+    """Parse an ISO-8601 timestamp into a naive UTC
+    :py:class:`~datetime.datetime`.
+
+    :param str value: a timestamp in the ``YYYY-MM-DDTHH:MM:SS`` form
+        optionally followed by fractional seconds and a ``Z`` or
+        ``+HH:MM``/``-HH:MM`` UTC offset.  Timestamps without an offset are
+        assumed to be in UTC.
+    :raises: :py:class:`ValueError` if ``value`` is not a valid timestamp
+
+    >>> parse_iso8601('2012-03-24T11:56:48Z')
+    datetime.datetime(2012, 3, 24, 11, 56, 48)
+    >>> parse_iso8601('2012-03-24T11:56:48.25-05:00')
+    datetime.datetime(2012, 3, 24, 16, 56, 48, 250000)
+
+    This only handles the fixed layout above so it is considerably faster
+    than :py:meth:`datetime.datetime.strptime`.
+    """
+    try:
+        if (value[4] != '-' or value[7] != '-' or value[10] not in 'Tt ' or
+                value[13] != ':' or value[16] != ':'):
+            raise ValueError()
+        # int() accepts signs and whitespace so the digits are checked
+        if not (value[0:4] + value[5:7] + value[8:10] + value[11:13] +
+                value[14:16] + value[17:19]).isdigit():
+            raise ValueError()
+        microsecond, index = 0, 19
+        if value[index:index + 1] in ('.', ','):
+            index += 1
+            while value[index:index + 1].isdigit():
+                index += 1
+            fraction = value[20:index]
+            if not fraction:
+                raise ValueError()
+            microsecond = int(fraction[:6].ljust(6, '0'))
+        result = datetime.datetime(int(value[0:4]), int(value[5:7]),
+                int(value[8:10]), int(value[11:13]), int(value[14:16]),
+                int(value[17:19]), microsecond)
+        zone = value[index:]
+        if zone in ('', 'Z', 'z'):
+            return result
+        if zone[0] not in '+-' or len(zone) not in (3, 5, 6):
+            raise ValueError()
+        if len(zone) == 6 and zone[3] != ':':
+            raise ValueError()
+        minutes = zone[-2:] if len(zone) > 3 else '00'
+        if not (zone[1:3] + minutes).isdigit():
+            raise ValueError()
+        if int(zone[1:3]) > 23 or int(minutes) > 59:
+            raise ValueError()
+        offset = datetime.timedelta(hours=int(zone[1:3]),
+                minutes=int(minutes))
+        # normalizing can move the timestamp out of the supported range
+        if zone[0] == '-':
+            return result + offset
+        return result - offset
+    except (IndexError, OverflowError, TypeError, ValueError):
+        raise ValueError('invalid ISO-8601 timestamp {0!r}'.format(value))
+
+
 def deprecated(func):
     @functools.wraps(func)
     def decorated(*any, **args):
@@ -33,10 +96,20 @@ class LinkMap(object):
     
     You can append to the list of actions using the :py:func:`advertise`
     decorator on a Flask view function.
+
+    The URL of each action is only built with :py:func:`flask.url_for`
+    the first time that :py:attr:`links` is requested for an application
+    root.  The ``session_key`` argument is replaced by a placeholder at
+    that point so later requests produce their links by splicing the
+    session key into the compiled URLs.
     """
+
+    _SESSION_KEY_PLACEHOLDER = '__session_key__'
+
     def __init__(self):
         super(LinkMap, self).__init__()
         self._links = {}
+        self._link_tables = {}
 
     def advertise(self, *advertisement_info):
         """Decorate a function as an advertised link.
@@ -82,6 +155,7 @@ class LinkMap(object):
                     self._links[name] = {'method': method,
                             'function': func.__name__,
                             'args': inspect.getargspec(func).args}
+            self._link_tables.clear()
             return func
         return decorator
 
@@ -107,17 +181,51 @@ class LinkMap(object):
         """A dict mapping link names to link objects.  A *link object* is
         nothing more than a dictionary containing the method and URL to
         apply it to."""
+        link_table, digest = self._link_table()
+        session_key = None
+        if flask.g.user.logged_in:
+            session_key = werkzeug.urls.url_quote(flask.g.user.session_key)
         links = {}
+        for (link_name, method, url_parts) in link_table:
+            if len(url_parts) == 1:
+                links[link_name] = {'method': method, 'url': url_parts[0]}
+            elif session_key is not None:
+                links[link_name] = {'method': method,
+                        'url': session_key.join(url_parts)}
+        return links
+
+    @property
+    def links_digest(self):
+        """A short digest of the links that are advertised for the current
+        application root.  It changes whenever :py:attr:`links` would
+        answer different URLs or methods for the same session, so it can
+        be included in validators for responses that contain links."""
+        link_table, digest = self._link_table()
+        return digest
+
+    def _link_table(self):
+        script_root = flask.request.script_root
+        entry = self._link_tables.get(script_root)
+        if entry is None:
+            link_table = self._compile_links()
+            digest = hashlib.sha1(repr(sorted(link_table))).hexdigest()[:12]
+            entry = self._link_tables[script_root] = (link_table, digest)
+        return entry
+
+    def _compile_links(self):
+        """Build a list of ``(link_name, method, url_parts)`` tuples where
+        *url_parts* is the link's URL split around the session key."""
+        link_table = []
         for (link_name, link_dict) in self._links.iteritems():
             args = dict()
             for arg in link_dict['args']:
                 if arg == 'session_key':
-                    if flask.g.user.logged_in:
-                        args['session_key'] = flask.g.user.session_key
+                    args['session_key'] = self._SESSION_KEY_PLACEHOLDER
                 else:  # pragma: no cover
                     self.logger.warn('unhandled argument %s in link %s',
                             arg, link_name)
             if len(args) == len(link_dict['args']):
-                links[link_name] = self.build_link(link_name, **args)
-        return links
-
+                url = self.build_link(link_name, **args)['url']
+                link_table.append((link_name, link_dict['method'],
+                    url.split(self._SESSION_KEY_PLACEHOLDER)))
+        return link_table
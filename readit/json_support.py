@@ -1,11 +1,25 @@
 """
 Pluggable JSON Support Layer
 ============================
+
+The objects that we know how to encode are described by the encoders that
+:py:class:`JSONEncoder` consults.  The library that does the actual work
+of producing JSON text is described by a :py:class:`JSONBackend`.  Use
+:py:func:`create_backend` to pick a backend by module name.  Any module
+that provides a :py:mod:`json` compatible ``JSONEncoder`` class will do;
+the ones listed in :py:data:`BACKENDS` are known to work.  A backend can
+be given a :py:class:`FragmentCache` so that the JSON text of objects that
+never change is produced once and reused.
+
 """
 import datetime
+import importlib
+import inspect
+import itertools
 
 import flask
 import readit
+import readit.cache
 import pymongo.objectid
 
 
@@ -13,29 +27,249 @@ class JSONEncoder(flask.json.JSONEncoder):
     """Specialization of :py:class:`flask.json.JSONEncoder` that supports
     encoding some of our objects.
     
-    New objects are supported by adding new encoder instances to
-    :py:attr:`json_encoder`.  A *encoder instance* is something that implements
-    the following simple protocol:
+    New objects are supported by adding new encoder instances with
+    :py:meth:`add_encoder`.  A *encoder instance* is something that
+    implements the following simple protocol:
     
      - ``enc.can_encode(object) -> bool``
      - ``enc.encode(object) -> dict``
+     - ``enc.types`` is an optional tuple of the classes that the
+       encoder handles
     
-    A number of useful encoders are loaded into :py:attr:`json_encoder`
-    automatically and additional encoders can be added as needed.
+    A number of useful encoders are loaded into :py:attr:`json_encoders`
+    automatically and additional encoders can be added as needed, either
+    with :py:meth:`add_encoder` or by modifying the list directly.
+
+    The encoder for an object is found by class first.  The classes listed
+    in each encoder's ``types`` are looked up along the object's method
+    resolution order and the result is cached by class, so encoding many
+    objects of a registered class costs a single dictionary lookup per
+    object.  If that fails, then each encoder's ``can_encode`` method is
+    tried in turn.  Its answer may depend on the instance so it is never
+    cached.
     """
     def __init__(self, *args, **kwds):
         super(JSONEncoder, self).__init__(*args, **kwds)
-        self.json_encoders = [
-            DateTimeJSONSupport(),
-            ObjectIdJSONSupport(),
-            ReadingSupport(),
-        ]
+        self._encoder_cache = {}
+        self.json_encoders = [DateTimeJSONSupport(), ObjectIdJSONSupport(),
+                              ReadingSupport()]
+
+    @property
+    def json_encoders(self):
+        """The list of encoders that I consult in order.  Changing it
+        discards the encoders that I cached by class."""
+        return self._json_encoders
+
+    @json_encoders.setter
+    def json_encoders(self, supporters):
+        self._json_encoders = _EncoderList(supporters,
+                self._encoder_cache.clear)
+        self._encoder_cache.clear()
+
+    def add_encoder(self, supporter):
+        """Add *supporter* to the list of encoders that I consult."""
+        self._json_encoders.append(supporter)
 
     def default(self, o):
-        for supporter in self.json_encoders:
-            if supporter.can_encode(o):
-                return supporter.encode(o)
-        return super(JSONEncoder, self).default(o)
+        cls = o.__class__
+        try:
+            supporter = self._encoder_cache[cls]
+        except KeyError:
+            supporter = self._encoder_cache[cls] = self._find_type_encoder(cls)
+        if supporter is None:
+            for candidate in self._json_encoders:
+                if candidate.can_encode(o):
+                    return candidate.encode(o)
+            return super(JSONEncoder, self).default(o)
+        return supporter.encode(o)
+
+    def _find_type_encoder(self, cls):
+        for base in inspect.getmro(cls):
+            for supporter in self._json_encoders:
+                if base in getattr(supporter, 'types', ()):
+                    return supporter
+        return None
+
+
+class _EncoderList(list):
+    # a list that calls on_change whenever it is modified in place
+    def __init__(self, iterable, on_change):
+        super(_EncoderList, self).__init__(iterable)
+        self._on_change = on_change
+
+
+def _notify_change(name):
+    method = getattr(list, name)
+
+    def changed(self, *args, **kwds):
+        result = method(self, *args, **kwds)
+        self._on_change()
+        return result
+    changed.__name__ = name
+    return changed
+
+
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__',
+              '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop',
+              'remove', 'reverse', 'sort'):
+    setattr(_EncoderList, _name, _notify_change(_name))
+del _name
+
+
+BACKENDS = ('json', 'simplejson')
+"""The modules that are known to work as a :py:class:`JSONBackend`.  The
+first one is used when :py:func:`create_backend` is not told otherwise."""
+
+
+class JSONBackend(object):
+    """I encode objects to JSON text using the ``JSONEncoder`` class of a
+    :py:mod:`json` compatible *module*.
+
+    The encoder is created once and reused for every call to
+    :py:meth:`encode`.  Objects that the module does not understand are
+    handed to :py:meth:`JSONEncoder.default` of *json_encoder* so every
+    backend produces the same output.
+
+    >>> import json
+    >>> backend = JSONBackend(json)
+    >>> backend.encode({'when': datetime.datetime(2012, 3, 24, 11, 56, 48)})
+    '{"when": "2012-03-24T11:56:48Z"}'
+
+    If *fragment_cache* is a :py:class:`FragmentCache`, then the arrays
+    written by :py:meth:`iterencode_list` are assembled from the cached
+    JSON text of their elements whenever possible.
+    """
+
+    def __init__(self, module, json_encoder=None, fragment_cache=None):
+        super(JSONBackend, self).__init__()
+        self.module = module
+        self.json_encoder = json_encoder or JSONEncoder()
+        self.fragment_cache = fragment_cache
+        self._encoder = module.JSONEncoder(default=self.json_encoder.default)
+
+    @property
+    def name(self):
+        return self.module.__name__
+
+    def encode(self, obj):
+        return self._encoder.encode(obj)
+
+    def iterencode_list(self, items, chunk_size=100):
+        """Generate the JSON text of an array that contains every element
+        of *items* without holding all of them at once.
+
+        Elements are pulled from *items* and encoded *chunk_size* at a
+        time, so *items* can be a generator over a database cursor.
+
+        >>> import json
+        >>> ''.join(JSONBackend(json).iterencode_list(xrange(5), 2))
+        '[0, 1, 2, 3, 4]'
+        """
+        items = iter(items)
+        separator = '['
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            yield separator + self._encode_elements(chunk)
+            separator = ', '
+        yield '[]' if separator == '[' else ']'
+
+    def encode_fragment(self, obj):
+        """Encode *obj* using the fragment cache if it is cacheable."""
+        if self.fragment_cache is None:
+            return self._encoder.encode(obj)
+        key = self.fragment_cache.key_for(obj)
+        if key is None:
+            return self._encoder.encode(obj)
+        fragment = self.fragment_cache.get(key)
+        if fragment is None:
+            fragment = self._encoder.encode(obj)
+            self.fragment_cache.put(key, fragment)
+        return fragment
+
+    def _encode_elements(self, elements):
+        if self.fragment_cache is None:
+            return self._encoder.encode(elements)[1:-1]
+        return ', '.join(self.encode_fragment(obj) for obj in elements)
+
+    def iterencode_object(self, obj, name, items, chunk_size=100):
+        """Generate the JSON text of the dictionary *obj* with the extra
+        property *name* set to the array of *items*.
+
+        The properties in *obj* are written immediately and *items* is
+        written incrementally by :py:meth:`iterencode_list`.
+
+        >>> import json
+        >>> backend = JSONBackend(json)
+        >>> ''.join(backend.iterencode_object({}, 'numbers', xrange(3)))
+        '{"numbers": [0, 1, 2]}'
+        """
+        head = self._encoder.encode(obj)[:-1]
+        if obj:
+            head += ', '
+        yield head + self._encoder.encode(name) + ': '
+        for fragment in self.iterencode_list(items, chunk_size):
+            yield fragment
+        yield '}'
+
+    def __str__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.name)
+
+
+def create_backend(module_name=None, fragment_cache=None):
+    """Create a :py:class:`JSONBackend` for *module_name*.
+
+    If *module_name* is omitted, then the first module in
+    :py:data:`BACKENDS` is used.  An :py:exc:`ImportError` is raised when
+    the requested module is not installed.
+
+    >>> create_backend().name
+    'json'
+    """
+    return JSONBackend(importlib.import_module(module_name or BACKENDS[0]),
+            fragment_cache=fragment_cache)
+
+
+class FragmentCache(readit.cache.LRUCache):
+    """I remember the JSON text of up to *max_size* objects.
+
+    Fragments are keyed by the string form of the object's ``object_id``
+    and only instances of *types* are cached, since they are the objects
+    that do not change once they have been saved.  An object that is
+    missing any of the *required* attributes was retrieved with a
+    ``fields`` projection, so it is encoded without being cached.  When I
+    am full, the least recently used fragment is evicted.
+
+    >>> cache = FragmentCache(max_size=2)
+    >>> for key in ['a', 'b', 'a', 'c']:
+    ...     if cache.get(key) is None:
+    ...         cache.put(key, '"{0}"'.format(key))
+    >>> 'a' in cache, 'b' in cache, 'c' in cache
+    (True, False, True)
+
+    Call :py:meth:`discard` when the underlying object is removed.
+    """
+
+    def __init__(self, max_size=10000, types=(readit.Reading,),
+            required=('title', 'link', 'when', 'user_id')):
+        super(FragmentCache, self).__init__(max_size=max_size)
+        self.types = types
+        self.required = required
+
+    def key_for(self, obj):
+        """Answer the cache key for *obj* or ``None`` if it should not be
+        cached."""
+        if isinstance(obj, self.types):
+            object_id = getattr(obj, 'object_id', None)
+            if object_id is not None and all(
+                    getattr(obj, name, None) is not None
+                    for name in self.required):
+                return str(object_id)
+        return None
+
+    def discard(self, key):
+        super(FragmentCache, self).discard(str(key))
 
 
 class JSONDecoder(flask.json.JSONDecoder):
@@ -60,6 +294,8 @@ class DateTimeJSONSupport(object):
     :py:meth:`datetime.datetime.isoformat` on the instance and append
     'Z' explicitly.
     """
+    types = (datetime.datetime,)
+
     def __init__(self, *args, **kwds):
         super(DateTimeJSONSupport, self).__init__(*args, **kwds)
 
@@ -125,6 +361,8 @@ class ObjectIdJSONSupport(object):
     translated into JSONRPC syntax, but that really complicates things
     more than necessary.
     """
+    types = (pymongo.objectid.ObjectId,)
+
     def __init__(self, *args, **kwds):
         super(ObjectIdJSONSupport, self).__init__(*args, **kwds)
 
@@ -145,6 +383,8 @@ class ReadingSupport(StorableItemJSONSupport):
     True
     >>> result = self.encode(a_reading)
     """
+    types = (readit.Reading,)
+
     def __init__(self, *args, **kwds):
         super(ReadingSupport, self).__init__(*args, **kwds)
 
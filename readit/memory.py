@@ -0,0 +1,249 @@
+"""
+In-Memory Storage Layer
+=======================
+
+This module provides a version of :py:class:`readit.mongo.Storage` that
+keeps every document in the current process.  It exists so that the Flask,
+model, and JSON layers can be exercised and benchmarked at high request
+rates without a MongoDB deployment.  It is selected by setting the storage
+URL to something that starts with ``memory://``.
+
+Only the subset of the Mongo query language that :py:mod:`readit.mongo`
+generates is understood: equality, ``$lt``, ``$lte``, ``$gt``, ``$gte``,
+``$ne``, ``$in``, and ``$or``.  Updates understand ``$inc`` and ``$set``.
+
+"""
+from __future__ import with_statement
+
+import threading
+
+import pymongo
+import pymongo.errors
+from pymongo.objectid import ObjectId
+
+import readit.mongo
+
+
+def is_memory_url(storage_url):
+    """Does *storage_url* select the in-memory storage layer?
+
+    >>> is_memory_url('memory://'), is_memory_url('mongodb://localhost')
+    (True, False)
+    >>> is_memory_url(None)
+    False
+    """
+    return bool(storage_url) and storage_url.startswith('memory://')
+
+
+class Storage(readit.mongo.Storage):
+    """I implement the :py:class:`readit.mongo.Storage` interface on top of
+    an in-process :py:class:`Database`.
+
+    Every instance that is created with the same ``storage_url`` shares the
+    same database.  The indexes declared in
+    :py:attr:`~readit.mongo.Storage.INDEXES` are created when I am, so
+    lookups by ``user_id`` and ``email`` do not scan the collection.
+    """
+
+    _DATABASES = {}
+    _DATABASES_LOCK = threading.Lock()
+
+    def __init__(self, *args, **kwds):
+        super(Storage, self).__init__(*args, **kwds)
+        self.ensure_indexes()
+
+    def get_mongo_connection(self):
+        with Storage._DATABASES_LOCK:
+            if self.storage_url not in Storage._DATABASES:
+                Storage._DATABASES[self.storage_url] = Database()
+            return Storage._DATABASES[self.storage_url]
+
+
+class Database(object):
+    """I am a collection of :py:class:`Collection` instances that are
+    created on first access."""
+
+    def __init__(self):
+        super(Database, self).__init__()
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = Collection(name)
+            return self._collections[name]
+
+    def command(self, name):
+        return {'ok': 1.0}
+
+
+class Cursor(list):
+    """I am the list of documents answered by :py:meth:`Collection.find`."""
+
+    def batch_size(self, batch_size):
+        return self
+
+
+class Collection(object):
+    """I store documents in a :py:class:`dict` keyed by ``_id``.
+
+    Equality lookups on the leading field of an index created with
+    :py:meth:`ensure_index` are answered from a secondary index that maps
+    field values to the set of matching ``_id`` values.  Unique indexes
+    are enforced by :py:meth:`insert`.
+    """
+
+    def __init__(self, name):
+        super(Collection, self).__init__()
+        self.name = name
+        self._documents = {}
+        self._indexes = {}
+        self._unique = set()
+        self._lock = threading.RLock()
+
+    def ensure_index(self, key_or_list, unique=False, **ignored):
+        if isinstance(key_or_list, basestring):
+            field = key_or_list
+        else:
+            field = key_or_list[0][0]
+        with self._lock:
+            if field not in self._indexes:
+                index = {}
+                for document in self._documents.itervalues():
+                    index.setdefault(document.get(field), set()).add(
+                        document['_id'])
+                self._indexes[field] = index
+            if unique:
+                self._unique.add(field)
+
+    def insert(self, doc_or_docs, safe=False, continue_on_error=False,
+            **ignored):
+        if isinstance(doc_or_docs, dict):
+            doc_or_docs = [doc_or_docs]
+        error = None
+        with self._lock:
+            for document in doc_or_docs:
+                if '_id' not in document:
+                    document['_id'] = ObjectId()
+                try:
+                    self._insert_one(dict(document))
+                except pymongo.errors.DuplicateKeyError, exc:
+                    error = exc
+                    if not continue_on_error:
+                        break
+        if error is not None and safe:
+            raise error
+
+    def find(self, spec=None, fields=None, skip=0, limit=0, sort=None,
+            **ignored):
+        with self._lock:
+            documents = [document for document in self._candidates(spec)
+                         if _matches(document, spec or {})]
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda document: document.get(key),
+                    reverse=direction == pymongo.DESCENDING)
+        if skip:
+            documents = documents[skip:]
+        if limit:
+            documents = documents[:limit]
+        if fields is not None:
+            fields = set(fields) | set(['_id'])
+            return Cursor(dict((name, value)
+                               for (name, value) in document.iteritems()
+                               if name in fields)
+                          for document in documents)
+        return Cursor(dict(document) for document in documents)
+
+    def find_and_modify(self, query, update, upsert=False, new=False,
+            **ignored):
+        with self._lock:
+            for current in self._candidates(query):
+                if _matches(current, query):
+                    original = dict(current)
+                    break
+            else:
+                if not upsert:
+                    return None
+                original = None
+                current = dict((field, value)
+                               for (field, value) in query.iteritems()
+                               if not isinstance(value, dict)
+                               and not field.startswith('$'))
+                self.insert(current)
+                current = self._documents[current['_id']]
+            self._remove_one(current)
+            for field, amount in update.get('$inc', {}).iteritems():
+                current[field] = current.get(field, 0) + amount
+            current.update(update.get('$set', {}))
+            self._insert_one(current)
+            return dict(current) if new else original
+
+    def remove(self, spec=None, safe=False, **ignored):
+        removed = 0
+        with self._lock:
+            for document in list(self._candidates(spec)):
+                if _matches(document, spec or {}):
+                    self._remove_one(document)
+                    removed += 1
+        if safe:
+            return {'ok': 1.0, 'err': None, 'n': removed}
+
+    def _insert_one(self, document):
+        if document['_id'] in self._documents:
+            raise pymongo.errors.DuplicateKeyError(
+                'duplicate _id {0}'.format(document['_id']))
+        for field in self._unique:
+            if self._indexes[field].get(document.get(field)):
+                raise pymongo.errors.DuplicateKeyError(
+                    'duplicate {0} {1!r}'.format(field, document.get(field)))
+        self._documents[document['_id']] = document
+        for field, index in self._indexes.iteritems():
+            index.setdefault(document.get(field), set()).add(document['_id'])
+
+    def _remove_one(self, document):
+        del self._documents[document['_id']]
+        for field, index in self._indexes.iteritems():
+            object_ids = index[document.get(field)]
+            object_ids.discard(document['_id'])
+            if not object_ids:
+                del index[document.get(field)]
+
+    def _candidates(self, spec):
+        """Answer the documents that could match *spec* using the primary
+        key or a secondary index when possible."""
+        for field, value in (spec or {}).iteritems():
+            if isinstance(value, dict) or field.startswith('$'):
+                continue
+            if field == '_id':
+                document = self._documents.get(value)
+                return [document] if document is not None else []
+            if field in self._indexes:
+                return [self._documents[object_id] for object_id
+                        in self._indexes[field].get(value, ())]
+        return self._documents.values()
+
+
+_OPERATORS = {
+    '$lt': lambda value, operand: value is not None and value < operand,
+    '$lte': lambda value, operand: value is not None and value <= operand,
+    '$gt': lambda value, operand: value is not None and value > operand,
+    '$gte': lambda value, operand: value is not None and value >= operand,
+    '$ne': lambda value, operand: value != operand,
+    '$in': lambda value, operand: value in operand,
+}
+
+
+def _matches(document, spec):
+    for field, condition in spec.iteritems():
+        if field == '$or':
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = document.get(field)
+            for operator, operand in condition.iteritems():
+                if not _OPERATORS[operator](value, operand):
+                    return False
+        elif document.get(field) != condition:
+            return False
+    return True
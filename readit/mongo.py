@@ -23,6 +23,27 @@ transformation to and from Mongo documents.
       :param values dict: dictionary of values to reconstitute
       :return: object instance that implements :py:class:`Storable`
 
+   .. py:classmethod:: from_partial_persistence(values)
+
+      :param values dict: dictionary containing a subset of the persisted
+         values
+      :return: object instance that implements :py:class:`Storable`
+
+      This is optional.  It is only required for classes that are
+      retrieved with a ``fields`` projection.  Attributes that are not
+      present in *values* are left at their default values.
+
+   .. py:classmethod:: from_persistence_many(documents)
+
+      :param documents: sequence of Mongo documents including the ``_id``
+         attribute
+      :return: a :py:class:`list` of object instances with
+         :py:attr:`object_id` assigned
+
+      This is optional.  If it is implemented, then it is used instead of
+      :py:meth:`from_persistence` whenever a list of whole documents is
+      retrieved.
+
    .. py:attribute:: object_id
 
       The unique identifier for this object instance in the persistence
@@ -34,8 +55,12 @@ transformation to and from Mongo documents.
 """
 from __future__ import with_statement
 
+import calendar
+import datetime
 import logging
+import os
 import pymongo
+import pymongo.errors
 import threading
 
 from pymongo.objectid import ObjectId
@@ -52,13 +77,37 @@ class Storage(object):
     instances themselves must implement the :py:class:`Storable` protocol.
     """
 
-    _CONN = None
+    INSERT_BATCH_SIZE = 500
+
+    #: Maps collection names to the indexes that they require.  Each index
+    #: is a ``(keys, options)`` pair that is passed to
+    #: :py:meth:`~pymongo.collection.Collection.ensure_index` by
+    #: :py:meth:`ensure_indexes`.
+    INDEXES = {
+        'readings': [
+            ([('user_id', pymongo.ASCENDING), ('when', pymongo.DESCENDING),
+              ('_id', pymongo.DESCENDING)], {}),
+        ],
+        'users': [
+            ([('email', pymongo.ASCENDING)], {'unique': True}),
+        ],
+        'changes': [
+            ([('version_id', pymongo.ASCENDING),
+              ('version', pymongo.ASCENDING)], {}),
+        ],
+    }
+
+    _CONN_MANAGER = None
     _CONN_LOCK = threading.Lock()
 
-    def __init__(self, storage_url=None, id_extractor=None, logger=None):
+    def __init__(self, storage_url=None, id_extractor=None, logger=None,
+            pool_size=None, network_timeout=None, connect_timeout=None):
         self.storage_url = storage_url
         self.id_extractor = id_extractor
         self.logger = logger or logging.getLogger('readit.mongo')
+        self.connection_options = {'pool_size': pool_size,
+                'network_timeout': network_timeout,
+                'connect_timeout': connect_timeout}
 
     def save(self, storage_bin, storable):
         """Save *storable* into the data subset *storage_bin*.
@@ -74,35 +123,101 @@ class Storage(object):
         ``_id`` attribute.  Finally, the document is written to the storage
         engine.  If the ``object_id`` property was ``None`` initially, then
         it is updated with the ``_id`` attribute before returning.
+
+        The insert is acknowledged by the server just like the inserts
+        made by :py:meth:`save_many`.
+
+        :raises: :py:class:`pymongo.errors.OperationFailure` if the server
+            rejects the document
         """
-        persist = storable.to_persistence()
-        if storable.object_id is not None:
-            persist['_id'] = ObjectId(storable.object_id)
+        persist = self._make_document(storable)
         conn = self.get_mongo_connection()
-        conn[storage_bin].insert(persist)
-        if storable.object_id is None:
-            storable.object_id = str(persist['_id'])
+        conn[storage_bin].insert(persist, safe=True)
+        self._assign_object_id(storable, persist)
+
+    def save_many(self, storage_bin, storables, batch_size=None):
+        """Save each of *storables* into the data subset *storage_bin*.
 
-    def retrieve_one(self, storage_bin, **arguments):
+        :param storage_bin: the namespace to store the objects in.
+        :param storables: a sequence of objects to save.  Each object
+            may be modified before returning.
+        :param batch_size: the maximum number of documents to send to
+            the server in a single insert (*optional*).  This defaults to
+            :py:attr:`INSERT_BATCH_SIZE`.
+        :returns: a list of ``(storable, exception)`` pairs identifying
+            the objects that could not be saved.
+
+        This is the bulk version of :py:meth:`save`.  Documents are sent to
+        the server in batches instead of one round trip per object.  When a
+        batch is rejected, the documents that did not make it into the
+        collection are retried one at a time so that a single bad document
+        does not fail the entire batch.  The ``object_id`` is assigned to
+        each object that was successfully saved.
+        """
+        batch_size = batch_size or self.INSERT_BATCH_SIZE
+        storables = list(storables)
+        conn = self.get_mongo_connection()
+        collection = conn[storage_bin]
+        failures = []
+        for start in xrange(0, len(storables), batch_size):
+            batch = storables[start:start + batch_size]
+            documents = [self._make_document(storable) for storable in batch]
+            try:
+                collection.insert(documents, safe=True,
+                        continue_on_error=True)
+                saved = None
+            except pymongo.errors.OperationFailure, exc:
+                self.logger.warn('batch insert into %s failed: %s',
+                        storage_bin, exc)
+                batch_ids = [doc['_id'] for doc in documents]
+                saved = set(doc['_id'] for doc in collection.find(
+                    {'_id': {'$in': batch_ids}}, fields=['_id']))
+            for storable, document in zip(batch, documents):
+                if saved is not None and document['_id'] not in saved:
+                    try:
+                        collection.insert(document, safe=True)
+                    except pymongo.errors.OperationFailure, exc:
+                        failures.append((storable, exc))
+                        continue
+                self._assign_object_id(storable, document)
+        return failures
+
+    def retrieve_one(self, storage_bin, cls=None, **arguments):
         """Answers the result of calling :py:meth:`~Storage.retrieve` with
         the specified parameters.  The result is required to be a single
         object.
 
+        Since any second match is an error, the query is limited to two
+        documents and only the first one is passed to
+        :py:meth:`~Storable.from_persistence`.
+
         :raises: :py:class:`readit.MoreThanOneResultError` when more than one
                  result is returned by :py:meth:`~Storage.retrieve`"""
-        result = self.retrieve(storage_bin, **arguments)
+        arguments['limit'] = 2
+        result = list(self.iter_retrieve(storage_bin, **arguments))
         if len(result) > 1:
             raise readit.MoreThanOneResultError()
         if len(result) == 0:
             return None
+        if cls:
+            return self._manufacture_object(cls, result[0],
+                    partial=arguments.get('fields') is not None)
         return result[0]
 
-    def retrieve(self, storage_bin, storage_id=None, cls=None, **constraint):
+    def retrieve(self, storage_bin, storage_id=None, cls=None, sort=None,
+            limit=None, skip=None, fields=None, **constraint):
         """My answer is a list of objects that match the parameters.
 
         :param storage_bin: identifies the collection to retrieve from
         :param storage_id: identifies the Object ID to retrieve (*optional*)
         :param cls: a class that implements the :py:class:`Storable` protocol.
+        :param sort: a list of ``(key, direction)`` pairs that the server
+            orders the results by (*optional*)
+        :param limit: the maximum number of results to return (*optional*)
+        :param skip: the number of results to skip over (*optional*)
+        :param fields: a list of the attribute names to retrieve
+            (*optional*).  If this is omitted, then entire documents are
+            retrieved.
         :param constraint: the constraint to pass as the Mongo query.
 
         This method retrieves a set of objects from the Mongo collection
@@ -115,35 +230,404 @@ class Storage(object):
         is called for each retrieved document and the manufactured object is
         placed into the result set instead of the Mongo document.
 
+        The :py:data:`sort`, :py:data:`limit` and :py:data:`skip`
+        parameters are passed through to the server so that ordering can be
+        served by an index and only the requested documents are transferred.
+        Similarly, :py:data:`fields` limits the transfer to the named
+        attributes of each document.  Objects are manufactured from
+        projected documents using :py:meth:`Storable.from_partial_persistence`.
+
         The remaining parameters form the search constraint.  If no
         constraint is supplied, then all of the documents in the collection
         are returned.
         """
+        documents = list(self.iter_retrieve(storage_bin,
+            storage_id=storage_id, sort=sort, limit=limit, skip=skip,
+            fields=fields, **constraint))
+        if cls:
+            return self._manufacture_objects(cls, documents,
+                    partial=fields is not None)
+        return documents
+
+    def iter_retrieve(self, storage_bin, storage_id=None, cls=None,
+            sort=None, limit=None, skip=None, fields=None, batch_size=None,
+            **constraint):
+        """Generate the objects that match the parameters one at a time.
+
+        :param storage_bin: identifies the collection to retrieve from
+        :param storage_id: identifies the Object ID to retrieve (*optional*)
+        :param cls: a class that implements the :py:class:`Storable` protocol.
+        :param sort: see :py:meth:`retrieve`
+        :param limit: see :py:meth:`retrieve`
+        :param skip: see :py:meth:`retrieve`
+        :param fields: see :py:meth:`retrieve`
+        :param batch_size: the number of documents to fetch from the server
+            in each round trip (*optional*)
+        :param constraint: the constraint to pass as the Mongo query.
+
+        This is the streaming version of :py:meth:`retrieve`.  Instead of
+        reading the entire Mongo cursor into a list, documents are pulled
+        from the server in batches and each one is passed through
+        :py:meth:`~Storable.from_persistence` as it is consumed.  Nothing
+        is sent to the server until the first object is requested.
+        """
         self.logger.debug('looking up %s in %s', constraint, storage_bin)
         conn = self.get_mongo_connection()
         if storage_id is not None:
             constraint['_id'] = ObjectId(storage_id)
-        values = conn[storage_bin].find(constraint)
-        if values and cls:
-            def manufacture_object(data):
-                self.logger.debug('found %s', data)
-                object_id = data.pop('_id')
-                instance = cls.from_persistence(data)
-                instance.object_id = str(object_id)
-                return instance
-            values = (manufacture_object(data) for data in values)
-        return list(values)
+        options = {}
+        if sort:
+            options['sort'] = sort
+        if limit:
+            options['limit'] = limit
+        if skip:
+            options['skip'] = skip
+        if fields is not None:
+            options['fields'] = fields
+        values = conn[storage_bin].find(constraint, **options)
+        if batch_size is not None:
+            values = values.batch_size(batch_size)
+        for data in values:
+            if cls:
+                yield self._manufacture_object(cls, data,
+                        partial=fields is not None)
+            else:
+                yield data
+
+    def _make_document(self, storable):
+        persist = storable.to_persistence()
+        if storable.object_id is not None:
+            persist['_id'] = ObjectId(storable.object_id)
+        return persist
+
+    def _assign_object_id(self, storable, persist):
+        if storable.object_id is None:
+            storable.object_id = str(persist['_id'])
+
+    def _manufacture_objects(self, cls, documents, partial=False):
+        if not partial and hasattr(cls, 'from_persistence_many'):
+            self.logger.debug('found %d documents', len(documents))
+            return cls.from_persistence_many(documents)
+        return [self._manufacture_object(cls, data, partial=partial)
+                for data in documents]
+
+    def _manufacture_object(self, cls, data, partial=False):
+        self.logger.debug('found %s', data)
+        object_id = data.pop('_id')
+        if partial:
+            instance = cls.from_partial_persistence(data)
+        else:
+            instance = cls.from_persistence(data)
+        instance.object_id = str(object_id)
+        return instance
+
+    def retrieve_page(self, storage_bin, page_size, after=None, cls=None,
+            page_key='when', fields=None, **constraint):
+        """Retrieve a single page of objects ordered from newest to oldest.
+
+        :param storage_bin: identifies the collection to retrieve from
+        :param page_size: the maximum number of objects to return
+        :param after: a page cursor as returned from a previous call
+            (*optional*).  If this is omitted, then the first page is
+            retrieved.
+        :param cls: a class that implements the :py:class:`Storable` protocol.
+        :param page_key: the name of the :py:class:`~datetime.datetime`
+            attribute that orders the collection.
+        :param fields: a list of the attribute names to retrieve
+            (*optional*).  ``page_key`` is always retrieved.
+        :param constraint: the constraint to pass as the Mongo query.
+        :returns: a ``(objects, next_cursor)`` tuple.  ``next_cursor`` is
+            ``None`` when there are no more pages.
+
+        Pages are selected by *keyset* instead of by offset.  The documents
+        are ordered by ``page_key`` and ``_id`` (both descending) and the
+        cursor records the values of the last document on the page.  The
+        next page starts immediately after that document so the cost of
+        fetching any page is a bounded range scan over a
+        ``(page_key, _id)`` index regardless of how deep into the
+        collection it is.
+
+        :raises: :py:class:`ValueError` if ``after`` is not a valid cursor
+        """
+        if after is not None:
+            when, object_id = parse_page_cursor(after)
+            constraint['$or'] = [
+                {page_key: {'$lt': when}},
+                {page_key: when, '_id': {'$lt': object_id}},
+            ]
+        if fields is not None and page_key not in fields:
+            fields = list(fields) + [page_key]
+        documents = self.retrieve(storage_bin,
+                sort=[(page_key, pymongo.DESCENDING),
+                      ('_id', pymongo.DESCENDING)],
+                limit=page_size + 1, fields=fields, **constraint)
+        next_cursor = None
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            last = documents[-1]
+            next_cursor = make_page_cursor(last[page_key], last['_id'])
+        if cls:
+            documents = self._manufacture_objects(cls, documents,
+                    partial=fields is not None)
+        return documents, next_cursor
 
     def remove(self, storage_bin, storage_id, **constraint):
+        """Remove *storage_id* if it also matches *constraint*.
+
+        :returns: the number of objects that were removed
+        """
         constraint['_id'] = ObjectId(storage_id)
         conn = self.get_mongo_connection()
         collection = conn[storage_bin]
-        collection.remove(constraint)
+        return collection.remove(constraint, safe=True)['n']
+
+    def remove_many(self, storage_bin, storage_ids, **constraint):
+        """Remove every object in *storage_ids* that also matches
+        *constraint* with a single request.
+
+        :returns: the number of objects that were removed
+        """
+        constraint['_id'] = {'$in': [ObjectId(storage_id)
+                                     for storage_id in storage_ids]}
+        conn = self.get_mongo_connection()
+        return conn[storage_bin].remove(constraint, safe=True)['n']
+
+    def increment_version(self, storage_bin, storage_id):
+        """Record that the data identified by *storage_id* has changed.
+
+        :param storage_bin: the collection that holds the versions
+        :param storage_id: identifies the versioned data
+
+        :returns: the new version number
+
+        The version is a document of the form ``{'_id': storage_id,
+        'version': counter, 'modified': datetime}`` that is created on the
+        first change and atomically incremented on each subsequent one.
+        """
+        conn = self.get_mongo_connection()
+        document = conn[storage_bin].find_and_modify({'_id': storage_id},
+                {'$inc': {'version': 1},
+                 '$set': {'modified': datetime.datetime.utcnow()}},
+                upsert=True, new=True)
+        return document['version']
+
+    def retrieve_version(self, storage_bin, storage_id):
+        """Answer the ``(version, modified)`` pair that was most recently
+        recorded by :py:meth:`increment_version` for *storage_id*.
+
+        ``(0, None)`` is returned if it has never been changed.  This is a
+        single lookup by primary key, so it is meant to be used to decide
+        whether the versioned data needs to be retrieved at all.
+        """
+        document = self.retrieve_one(storage_bin, _id=storage_id)
+        if document is None:
+            return 0, None
+        return document['version'], document['modified']
+
+    def record_changes(self, storage_bin, storage_id, version, added=(),
+            removed=()):
+        """Append entries to the change log for *storage_id*.
+
+        :param storage_bin: the collection that holds the change log
+        :param storage_id: identifies the versioned data, this is the same
+            identifier that is passed to :py:meth:`increment_version`
+        :param version: the version that the change produced
+        :param added: the object IDs that were added in *version*
+        :param removed: the object IDs that were removed in *version*
+
+        Each entry is a document of the form ``{'version_id': storage_id,
+        'version': version, 'object_id': ObjectId, 'removed': bool,
+        'recorded': datetime}``.  The entries for removed objects are the
+        *tombstones* that let a client that synchronized before the
+        removal find out about it.
+        """
+        recorded = datetime.datetime.utcnow()
+        documents = [{'version_id': storage_id, 'version': version,
+                      'object_id': ObjectId(str(object_id)), 'removed': False,
+                      'recorded': recorded}
+                     for object_id in added]
+        documents.extend({'version_id': storage_id, 'version': version,
+                          'object_id': ObjectId(str(object_id)),
+                          'removed': True, 'recorded': recorded}
+                         for object_id in removed)
+        if documents:
+            conn = self.get_mongo_connection()
+            conn[storage_bin].insert(documents, safe=True)
+
+    def retrieve_changes(self, storage_bin, storage_id, since):
+        """Answer the object IDs that were added and removed after version
+        *since* as an ``(added, removed, latest)`` tuple.
+
+        An object that was added and then removed after *since* only
+        appears in the ``removed`` list.  *latest* is the newest version
+        that was found in the change log or *since* if there were no
+        entries after it.  It is the version that the changes bring a
+        client up to, which can lag behind :py:meth:`retrieve_version`
+        while the entries for a new version are being written.  ``None``
+        is returned if the entries after *since* have been discarded by
+        :py:meth:`prune_changes`.
+        """
+        added, removed, latest = [], set(), since
+        entries = self.iter_retrieve(storage_bin,
+                sort=[('version', pymongo.ASCENDING)],
+                fields=['object_id', 'removed', 'horizon', 'version'],
+                version_id=storage_id, version={'$gt': since})
+        for entry in entries:
+            if entry.get('horizon'):
+                return None
+            latest = max(latest, entry['version'])
+            if entry['removed']:
+                removed.add(entry['object_id'])
+            else:
+                added.append(entry['object_id'])
+        return ([object_id for object_id in added if object_id not in removed],
+                sorted(removed), latest)
+
+    def prune_changes(self, storage_bin, storage_id, before):
+        """Discard the change log entries for *storage_id* that were
+        recorded before the :py:class:`~datetime.datetime` *before*.
+
+        :returns: the newest version that was discarded or ``None`` if
+            nothing was discarded
+
+        A *horizon* entry of the form ``{'version_id': storage_id,
+        'version': version, 'horizon': True, 'recorded': datetime}`` is
+        written for the newest discarded version before anything is
+        removed.  Every other entry up to that version is then removed,
+        including earlier horizon entries.  :py:meth:`retrieve_changes`
+        finds the horizon for any earlier version and reports that the
+        changes are no longer available.
+        """
+        conn = self.get_mongo_connection()
+        collection = conn[storage_bin]
+        expired = {'version_id': storage_id, 'recorded': {'$lt': before}}
+        newest = list(collection.find(expired, fields=['version'],
+                sort=[('version', pymongo.DESCENDING)], limit=1))
+        if not newest:
+            return None
+        horizon = newest[0]['version']
+        horizon_id = ObjectId()
+        collection.insert({'_id': horizon_id, 'version_id': storage_id,
+                'version': horizon, 'horizon': True,
+                'recorded': datetime.datetime.utcnow()}, safe=True)
+        collection.remove({'version_id': storage_id,
+                'version': {'$lte': horizon}, '_id': {'$ne': horizon_id}})
+        return horizon
+
+    def warm_up(self):
+        """Establish the connection to the server and make sure that it is
+        responding.
+
+        :raises: :py:class:`pymongo.errors.ConnectionFailure` if the server
+            cannot be reached
+        """
+        self.get_mongo_connection().command('ping')
+
+    def ensure_indexes(self):
+        """Create the indexes listed in :py:attr:`INDEXES` if they do not
+        already exist.
+
+        Index creation can be expensive on a populated collection so this
+        is meant to be run as a deployment step instead of on the request
+        path.  The indexes are built in the background so that the
+        collections remain available while they are created.
+        """
+        conn = self.get_mongo_connection()
+        for storage_bin in sorted(self.INDEXES):
+            for keys, options in self.INDEXES[storage_bin]:
+                self.logger.info('ensuring index %s on %s', keys, storage_bin)
+                conn[storage_bin].ensure_index(keys, background=True,
+                        **options)
 
     def get_mongo_connection(self):
-        if Storage._CONN is None:
+        if Storage._CONN_MANAGER is None:
             with Storage._CONN_LOCK:
-                if Storage._CONN is None:
-                    Storage._CONN = pymongo.Connection(host=self.storage_url)
-        return Storage._CONN.readit
+                if Storage._CONN_MANAGER is None:
+                    Storage._CONN_MANAGER = ConnectionManager(
+                        self.storage_url, logger=self.logger,
+                        **self.connection_options)
+        return Storage._CONN_MANAGER.get_connection().readit
+
+
+class ConnectionManager(object):
+    """I own the process-wide :py:class:`pymongo.Connection`.
+
+    :param storage_url: the Mongo URI to connect to
+    :param pool_size: the maximum number of sockets to pool (*optional*)
+    :param network_timeout: the number of seconds to wait for a socket
+        operation before giving up (*optional*)
+    :param connect_timeout: the number of seconds to wait for a new
+        socket to connect before giving up (*optional*)
+    :param logger: the :py:class:`logging.Logger` to report to
+
+    The connection is created lazily and is tied to the process that
+    created it.  When the application runs under a pre-forking server,
+    the connection that a worker inherits from its parent shares sockets
+    with every other worker.  I notice that the process ID has changed
+    and create a new connection for the child instead of using the
+    inherited one.  Options that are ``None`` are left at the driver's
+    defaults.
+    """
 
+    def __init__(self, storage_url=None, pool_size=None,
+            network_timeout=None, connect_timeout=None, logger=None):
+        super(ConnectionManager, self).__init__()
+        self.storage_url = storage_url
+        self.logger = logger or logging.getLogger('readit.mongo')
+        self.options = {}
+        if pool_size is not None:
+            self.options['max_pool_size'] = pool_size
+        if network_timeout is not None:
+            self.options['network_timeout'] = network_timeout
+        if connect_timeout is not None:
+            self.options['connectTimeoutMS'] = int(connect_timeout * 1000)
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        """Answers the connection for the current process."""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    if self._connection is not None:
+                        # the sockets belong to our parent so we simply
+                        # abandon them instead of closing them
+                        self.logger.info('process %d forked from %d, '
+                                'reconnecting', pid, self._pid)
+                    self._connection = pymongo.Connection(
+                        host=self.storage_url, **self.options)
+                    self._pid = pid
+        return self._connection
+
+
+def make_page_cursor(when, object_id):
+    """Answers an opaque, URL-safe page cursor for the document identified
+    by *when* and *object_id*.
+
+    >>> make_page_cursor(datetime.datetime(2012, 3, 24, 11, 56, 48),
+    ...                  '4fadcd174e02d83c8c000000')
+    '1332590208-4fadcd174e02d83c8c000000'
+    """
+    return '{0}-{1}'.format(calendar.timegm(when.utctimetuple()), object_id)
+
+
+def parse_page_cursor(cursor):
+    """Answers the ``(when, object_id)`` pair encoded in *cursor*.
+
+    >>> when, object_id = parse_page_cursor(
+    ...     '1332590208-4fadcd174e02d83c8c000000')
+    >>> when
+    datetime.datetime(2012, 3, 24, 11, 56, 48)
+    >>> object_id
+    ObjectId('4fadcd174e02d83c8c000000')
+
+    :raises: :py:class:`ValueError` if *cursor* is malformed
+    """
+    try:
+        timestamp, object_id = cursor.split('-', 1)
+        return (datetime.datetime.utcfromtimestamp(int(timestamp)),
+                ObjectId(object_id))
+    except Exception:
+        raise ValueError('invalid page cursor {0!r}'.format(cursor))
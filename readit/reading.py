@@ -1,4 +1,8 @@
+import bisect
 import datetime
+import operator
+
+import readit.helpers
 
 
 class Reading(object):
@@ -33,13 +37,17 @@ class Reading(object):
     The other interesting property of an item that the user has read is
     when it was read.  This is tracked by my ``when`` attribute which is
     a :py:class:`~datetime.datetime` instance but can specified as a
-    ISO-8601 encoded string as well.  However, ``datetime`` instances
-    have the sub-second portion dropped.
+    ISO-8601 encoded string as well.  Strings that include a UTC offset
+    are converted to UTC.  However, ``datetime`` instances have the
+    sub-second portion dropped.
     
     >>> when = '2012-03-24T11:56:48Z'
     >>> r = Reading('<Title>', '<Link>', when)
     >>> r.when
     datetime.datetime(2012, 3, 24, 11, 56, 48)
+    >>> r.when = '2012-03-24T07:56:48.5-04:00'
+    >>> r.when
+    datetime.datetime(2012, 3, 24, 11, 56, 48)
     >>> now = datetime.datetime.utcnow()
     >>> r = Reading(title='<Title>', link='<Link>', when=now)
     >>> r.when == (now - datetime.timedelta(microseconds=now.microsecond))
@@ -60,8 +68,13 @@ class Reading(object):
     >>> a_set.remove(Reading('<Title>', '<Link>'))
     >>> len(a_set)
     0
+
+    A reading list can contain many thousands of instances so I use
+    ``__slots__`` instead of a per-instance ``__dict__``.
     """
 
+    __slots__ = ('object_id', 'title', 'link', '_when', '_user_id')
+
     def __init__(self, title=None, link=None, when=None, user=None):
         super(Reading, self).__init__()
         self.object_id = None
@@ -79,8 +92,7 @@ class Reading(object):
     @when.setter
     def when(self, value):
         if isinstance(value, (str, unicode)):
-            dt_string, rest = value[0:19], value[19:]
-            value = datetime.datetime.strptime(dt_string, '%Y-%m-%dT%H:%M:%S')
+            value = readit.helpers.parse_iso8601(value)
         self._when = value - datetime.timedelta(microseconds=value.microsecond)
 
     @property
@@ -108,6 +120,60 @@ class Reading(object):
         instance._user_id = persist_dict['user_id']
         return instance
 
+    @classmethod
+    def from_persistence_many(cls, documents):
+        """Create instances from a sequence of Mongo documents.
+
+        This is the bulk version of :py:meth:`from_persistence`.  The
+        documents are expected to come straight from the persistence layer
+        so they include the ``_id`` attribute and ``when`` is already a
+        :py:class:`~datetime.datetime`.  Instances are built without running
+        :py:meth:`__init__` or the property setters.
+
+        >>> when = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        >>> readings = Reading.from_persistence_many([
+        ...     {'_id': 1234, 'title': '<Title>', 'link': '<Link>',
+        ...      'when': when, 'user_id': '<UserId>'}])
+        >>> r = readings[0]
+        >>> r.object_id, r.title, r.link, r.when == when, r.user_id
+        ('1234', '<Title>', '<Link>', True, '<UserId>')
+        """
+        new_instance = cls.__new__
+        instances = []
+        for document in documents:
+            when = document['when']
+            if not isinstance(when, datetime.datetime) or when.microsecond:
+                instance = cls.from_persistence(document)
+            else:
+                instance = new_instance(cls)
+                instance.title = document['title']
+                instance.link = document['link']
+                instance._when = when
+                instance._user_id = document['user_id']
+            instance.object_id = str(document['_id'])
+            instances.append(instance)
+        return instances
+
+    @classmethod
+    def from_partial_persistence(cls, persist_dict):
+        """Create an instance from a subset of the persisted attributes.
+        Attributes that are not present are left as ``None``, including
+        ``when`` which would otherwise default to the current time.
+
+        >>> r = Reading.from_partial_persistence({'title': '<Title>'})
+        >>> r.title, r.link, r.when, r.user_id
+        ('<Title>', None, None, None)
+        """
+        instance = cls()
+        instance.title = persist_dict.get('title')
+        instance.link = persist_dict.get('link')
+        if 'when' in persist_dict:
+            instance.when = persist_dict['when']
+        else:
+            instance._when = None
+        instance._user_id = persist_dict.get('user_id')
+        return instance
+
     def __eq__(self, other):
         if self is other:
             return True
@@ -125,3 +191,113 @@ class Reading(object):
     def __hash__(self):
         return (3 + hash(self.title)) + (5 * hash(self.link))
 
+
+class ReadingList(object):
+    """I keep a collection of :py:class:`Reading` instances ordered by
+    their ``when`` attribute, most recent first, without duplicates.
+
+    Readings are kept in order as they are added so reading the collection
+    never requires sorting it.  Duplicates are detected using
+    :py:class:`Reading` equality and the first instance added wins, just
+    like a :py:class:`set`.
+
+    >>> readings = ReadingList()
+    >>> readings.add(Reading('first', 'link', '2012-03-24T11:00:00Z'))
+    True
+    >>> readings.add(Reading('second', 'link', '2012-03-25T11:00:00Z'))
+    True
+    >>> readings.add(Reading('first', 'link', '2012-03-26T11:00:00Z'))
+    False
+    >>> [r.title for r in readings]
+    ['second', 'first']
+
+    Lookups and removal use a binary search over the ordered readings.
+    The ordering is captured when a reading is added, so you should not
+    modify ``when``, ``title``, or ``link`` of a reading while it is a
+    member.
+    """
+
+    def __init__(self, readings=()):
+        super(ReadingList, self).__init__()
+        self._keys = []       # ascending sort keys
+        self._readings = []   # parallel to _keys
+        self._members = {}    # maps readings to the instance that we hold
+        self.update(readings)
+
+    @staticmethod
+    def _key(reading):
+        return (reading.when, reading.title, reading.link)
+
+    def add(self, reading):
+        """Add *reading* unless an equal reading is already present.
+
+        :returns: ``True`` if *reading* was added
+        """
+        if reading in self._members:
+            return False
+        key = self._key(reading)
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._readings.insert(index, reading)
+        self._members[reading] = reading
+        return True
+
+    def update(self, readings):
+        """Add each of *readings* with a single merge instead of one
+        insertion at a time."""
+        added = []
+        for reading in readings:
+            if reading not in self._members:
+                self._members[reading] = reading
+                added.append((self._key(reading), reading))
+        if added:
+            if self._keys:
+                added.extend(zip(self._keys, self._readings))
+            added.sort(key=operator.itemgetter(0))
+            self._keys = [key for (key, _) in added]
+            self._readings = [reading for (_, reading) in added]
+
+    def remove(self, reading):
+        """Remove the reading equal to *reading*.
+
+        :raises: :py:class:`KeyError` if there is no such reading
+        """
+        member = self._members.pop(reading)
+        key = self._key(member)
+        index = bisect.bisect_left(self._keys, key)
+        while self._readings[index] is not member:
+            index += 1
+        del self._keys[index]
+        del self._readings[index]
+
+    def discard(self, reading):
+        """Remove the reading equal to *reading* if it is present."""
+        if reading in self._members:
+            self.remove(reading)
+
+    def newest(self, count):
+        """Answers a list of the *count* most recent readings."""
+        if count <= 0:
+            return []
+        return self._readings[:-count - 1:-1]
+
+    def between(self, start=None, end=None):
+        """Answers a list of the readings where ``start <= when < end``,
+        most recent first.  Either boundary may be ``None`` to leave that
+        side of the range open."""
+        low = 0
+        if start is not None:
+            low = bisect.bisect_left(self._keys, (start,))
+        high = len(self._keys)
+        if end is not None:
+            high = bisect.bisect_left(self._keys, (end,))
+        return self._readings[low:high][::-1]
+
+    def __contains__(self, reading):
+        return reading in self._members
+
+    def __iter__(self):
+        return reversed(self._readings)
+
+    def __len__(self):
+        return len(self._readings)
@@ -0,0 +1,211 @@
+"""
+Request-scoped Storage
+======================
+
+A :py:class:`UnitOfWork` wraps a :py:class:`readit.mongo.Storage` instance
+for the duration of a single request.  It keeps an *identity map* so that
+loading the same object twice answers the same instance, and it queues
+calls to :py:meth:`~UnitOfWork.save` and :py:meth:`~UnitOfWork.remove`
+until :py:meth:`~UnitOfWork.flush` is called.  The Flask application
+creates one for each request as ``flask.g.db`` and flushes it after the
+view function returns.
+
+"""
+import collections
+
+from pymongo.objectid import ObjectId
+
+
+class UnitOfWork(object):
+    """I provide the :py:class:`readit.mongo.Storage` interface on top of
+    *storage* for a single request.
+
+    Objects that are retrieved with a ``cls`` are recorded by
+    ``(storage_bin, object_id)``.  If the same document is retrieved
+    again, then the recorded instance is returned instead of a new one
+    and retrieving a single object by ``storage_id`` does not query the
+    storage layer at all.
+
+    Saved objects are assigned an ``object_id`` immediately so that they
+    can be referred to before they are written.  The queued writes are
+    sent to the storage layer by :py:meth:`flush` with one
+    :py:meth:`~readit.mongo.Storage.save_many` per collection and one
+    :py:meth:`~readit.mongo.Storage.remove_many` per collection and
+    constraint.  Functions registered with :py:meth:`after_flush` are
+    called once the writes have been made, even if some of them failed.
+    They can use :py:meth:`was_written` to find out which objects were
+    actually stored or removed.  An object that did not match the
+    constraint of its removal was not removed.
+
+    Methods that I do not implement are passed through to *storage*.
+    """
+
+    def __init__(self, storage):
+        super(UnitOfWork, self).__init__()
+        self.storage = storage
+        self._identity_map = {}
+        self._saves = collections.OrderedDict()
+        self._removes = collections.OrderedDict()
+        self._callbacks = []
+        self._written = set()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def __str__(self):
+        return '<{0} {1}>'.format(self.__class__.__name__, self.storage)
+
+    def save(self, storage_bin, storable):
+        """Queue *storable* to be saved into *storage_bin*."""
+        if storable.object_id is None:
+            storable.object_id = str(ObjectId())
+        self._saves.setdefault(storage_bin, []).append(storable)
+        self._identity_map[storage_bin, str(storable.object_id)] = storable
+
+    def remove(self, storage_bin, storage_id, **constraint):
+        """Queue the removal of *storage_id* from *storage_bin*.
+
+        :raises: :py:class:`pymongo.errors.InvalidId` immediately if
+            *storage_id* is not a valid object ID
+        """
+        ObjectId(storage_id)
+        key = (storage_bin, tuple(sorted(constraint.items())))
+        self._removes.setdefault(key, []).append(storage_id)
+        self._identity_map.pop((storage_bin, str(storage_id)), None)
+
+    def save_many(self, storage_bin, storables, batch_size=None):
+        """Flush the queued writes and then save *storables* immediately
+        since the caller needs to know which of them failed."""
+        self.flush()
+        storables = list(storables)
+        options = {}
+        if batch_size is not None:
+            options['batch_size'] = batch_size
+        failures = self.storage.save_many(storage_bin, storables, **options)
+        failed = set(id(storable) for (storable, exc) in failures)
+        for storable in storables:
+            if id(storable) not in failed:
+                self._identify(storage_bin, storable)
+                self._written.add((storage_bin, str(storable.object_id)))
+        return failures
+
+    def after_flush(self, func, *args, **kwds):
+        """Call ``func(*args, **kwds)`` after the next :py:meth:`flush`
+        has written the queued changes."""
+        self._callbacks.append((func, args, kwds))
+
+    def was_written(self, storage_bin, object_id):
+        """Was *object_id* saved into or removed from *storage_bin* since
+        the last :py:meth:`flush` finished?"""
+        return (storage_bin, str(object_id)) in self._written
+
+    def flush(self):
+        """Send the queued writes to the storage layer and then call the
+        functions registered with :py:meth:`after_flush`.
+
+        The functions are called even if a write fails, since the writes
+        that preceded it have already been made.
+
+        :raises: the first exception reported by
+            :py:meth:`~readit.mongo.Storage.save_many`
+        """
+        saves, self._saves = self._saves, collections.OrderedDict()
+        removes, self._removes = self._removes, collections.OrderedDict()
+        try:
+            for storage_bin, storables in saves.iteritems():
+                self._flush_saves(storage_bin, storables)
+            for (storage_bin, constraint), storage_ids in removes.iteritems():
+                self._flush_removes(storage_bin, storage_ids,
+                        dict(constraint))
+        finally:
+            callbacks, self._callbacks = self._callbacks, []
+            try:
+                for func, args, kwds in callbacks:
+                    func(*args, **kwds)
+            finally:
+                self._written.clear()
+
+    def _flush_saves(self, storage_bin, storables):
+        if len(storables) == 1:
+            self.storage.save(storage_bin, storables[0])
+            failures = []
+        else:
+            failures = self.storage.save_many(storage_bin, storables)
+        failed = set(id(storable) for (storable, exc) in failures)
+        self._written.update((storage_bin, str(storable.object_id))
+                             for storable in storables
+                             if id(storable) not in failed)
+        if failures:
+            raise failures[0][1]
+
+    def _flush_removes(self, storage_bin, storage_ids, constraint):
+        if len(storage_ids) == 1:
+            if not self.storage.remove(storage_bin, storage_ids[0],
+                    **constraint):
+                return
+        else:
+            # the count that remove_many answers does not say which of
+            # the objects matched, so look them up first
+            storage_ids = [str(document['_id']) for document
+                           in self.storage.retrieve(storage_bin,
+                               fields=['_id'],
+                               _id={'$in': [ObjectId(storage_id)
+                                            for storage_id in storage_ids]},
+                               **constraint)]
+            if not storage_ids:
+                return
+            self.storage.remove_many(storage_bin, storage_ids, **constraint)
+        self._written.update((storage_bin, str(storage_id))
+                             for storage_id in storage_ids)
+
+    def retrieve(self, storage_bin, storage_id=None, cls=None, **arguments):
+        if cls is not None and storage_id is not None and not arguments:
+            instance = self._identity_map.get((storage_bin, str(storage_id)))
+            if instance is not None:
+                return [instance]
+        return self._register(storage_bin,
+                self.storage.retrieve(storage_bin, storage_id=storage_id,
+                    cls=cls, **arguments),
+                cls, arguments.get('fields'))
+
+    def retrieve_one(self, storage_bin, cls=None, **arguments):
+        result = self.storage.retrieve_one(storage_bin, cls=cls, **arguments)
+        if result is None:
+            return None
+        return self._register(storage_bin, [result], cls,
+                arguments.get('fields'))[0]
+
+    def iter_retrieve(self, storage_bin, cls=None, **arguments):
+        """Generate the objects that match the parameters.
+
+        Instances that are already known are substituted, but new ones
+        are not recorded so that streaming a large result does not keep
+        every object alive until the end of the request.
+        """
+        results = self.storage.iter_retrieve(storage_bin, cls=cls,
+                **arguments)
+        if cls is None or arguments.get('fields') is not None:
+            return results
+        return (self._identity_map.get((storage_bin, str(result.object_id)),
+                                       result)
+                for result in results)
+
+    def retrieve_page(self, storage_bin, page_size, cls=None, **arguments):
+        documents, next_cursor = self.storage.retrieve_page(storage_bin,
+                page_size, cls=cls, **arguments)
+        return (self._register(storage_bin, documents, cls,
+                    arguments.get('fields')),
+                next_cursor)
+
+    def _register(self, storage_bin, results, cls, fields):
+        # partially loaded objects are not recorded since they would be
+        # returned to callers that expect every attribute to be present
+        if cls is None or fields is not None:
+            return results
+        return [self._identify(storage_bin, result) for result in results]
+
+    def _identify(self, storage_bin, instance):
+        if instance.object_id is None:
+            return instance
+        key = (storage_bin, str(instance.object_id))
+        return self._identity_map.setdefault(key, instance)
@@ -10,6 +10,8 @@ instances in the first place.
 """
 import uuid
 
+from .reading import ReadingList
+
 
 class User(object):
     """I represent a user that is registered in the system.
@@ -60,6 +62,9 @@ class User(object):
     True
     """
 
+    __slots__ = ('display_name', 'email', 'user_id', '_session_key',
+                 '_open_id', '_readings')
+
     def __init__(self, session_key=None):
         super(User, self).__init__()
         self.display_name = None
@@ -67,7 +72,7 @@ class User(object):
         self.user_id = None
         self._session_key = session_key
         self._open_id = None
-        self._readings = set()
+        self._readings = ReadingList()
 
     def login(self, details):
         """Update fields based on a successful login event.
@@ -137,7 +142,13 @@ class User(object):
     def readings(self):
         """Answers the list of things that this user has read in
         chronological order starting with the most recently read item."""
-        return sorted(self._readings, key=lambda r: r.when, reverse=True)
+        return list(self._readings)
+
+    @property
+    def reading_list(self):
+        """The :py:class:`~readit.reading.ReadingList` that holds my
+        readings.  Use this for top-N and date range queries."""
+        return self._readings
 
     def add_reading(self, reading):
         """Appends an item to the list of things that this user has read."""
@@ -150,8 +161,7 @@ class User(object):
 
         This is the same as calling :py:meth:`~User.add_reading` for each
         item in :py:obj:`readings`."""
-        for r in readings:
-            self.add_reading(r)
+        self._readings.update(readings)
 
     def remove_reading(self, reading):
         """Removes a reading from the user's list."""
@@ -183,6 +193,15 @@ class User(object):
         instance.display_name = value_dict.get('display_name', instance.email)
         return instance
 
+    @classmethod
+    def from_partial_persistence(cls, value_dict):
+        """Create an instance from a subset of the persisted attributes.
+        Attributes that are not present are left as ``None``."""
+        instance = cls()
+        instance.email = value_dict.get('email')
+        instance.display_name = value_dict.get('display_name')
+        return instance
+
     @property
     def object_id(self):
         return self.user_id
@@ -1,17 +1,25 @@
 from __future__ import with_statement
 
+import datetime
 import json
 import logging
 import os
 import os.path
 import re
+import shutil
+import tempfile
 import urllib
 
 import flask
 import mock
+import pymongo.errors
+from pymongo.objectid import ObjectId
 import werkzeug.exceptions
 
 import readit
+import readit.cache
+import readit.flaskapp
+import readit.memory
 
 from .testing import skipped, ReaditTestCase
 
@@ -82,9 +90,8 @@ class LoginTests(ReaditTestCase):
         self.assertIsNotNone(m)
         self.assertEquals('http://next.url/', m.group('next'))
 
-    @mock.patch(STORAGE_CLASS)
-    def test_user_lookup_in_login(self, storage_class):
-        storage = storage_class.return_value
+    @mock.patch.object(readit.app, 'storage')
+    def test_user_lookup_in_login(self, storage):
         storage.retrieve_one.return_value = self.fake_user
         with readit.app.test_request_context('/'):
             readit.app.preprocess_request()
@@ -96,12 +103,24 @@ class LoginTests(ReaditTestCase):
             self.assertEquals(flask.session['user_id'],
                     self.fake_user.user_id)
 
-    @mock.patch(STORAGE_CLASS)
-    def test_login_succeeded_throws_when_user_not_found(self, storage_class):
+    @mock.patch.object(readit.app, 'storage')
+    def test_user_lookup_is_cached(self, storage):
+        storage.retrieve_one.return_value = self.fake_user
+        for _ in xrange(2):
+            with readit.app.test_request_context('/'):
+                readit.app.preprocess_request()
+                readit.app._login_succeeded(self.fake_oid_details)
+                self.assertEquals(flask.session['user_id'],
+                        self.fake_user.user_id)
+                self.assertIsNot(flask.g.user, self.fake_user)
+        self.assertEquals(storage.retrieve_one.call_count, 1)
+        self.assertIsNone(self.fake_user.open_id)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_login_succeeded_throws_when_user_not_found(self, storage):
         """Tests that _login_succeeded raises an exception with the
         appropriate attributes set.  The error handling templates depend
         on the attributes."""
-        storage = storage_class.return_value
         storage.retrieve_one.return_value = None
         with readit.app.test_request_context('/'):
             readit.app.preprocess_request()
@@ -113,11 +132,10 @@ class LoginTests(ReaditTestCase):
                         self.fake_oid_details.identity_url)
                 self.assertEquals(exc.email, self.fake_oid_details.email)
 
-    @mock.patch(STORAGE_CLASS)
-    def test_login_with_unknown_user_triggers_404(self, storage_class):
+    @mock.patch.object(readit.app, 'storage')
+    def test_login_with_unknown_user_triggers_404(self, storage):
         with readit.app.test_request_context('/'):
             readit.app.preprocess_request()
-            storage = storage_class.return_value
             storage.retrieve_one.return_value = None
             response = mock.Mock()
             
@@ -179,42 +197,260 @@ class ApplicationTests(ReaditTestCase):
             readit.app.debug = debug
             readit.app.JAVASCRIPT_DEBUG_FILE_LIFETIME = lifetime
 
-    def test_reading_list_as_html(self):
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_as_html(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        storage.retrieve_page.return_value = ([], None)
         self.load_session(session_key=self.session_key)
         rv = self.client.get(self.get_session_url_for('/readings'), headers=[
             ('Accept', 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8')])
         self.assertEquals(rv.status_code, 200)
         self.assertEquals(rv.mimetype, 'text/html')
 
-    @mock.patch(STORAGE_CLASS)
-    def test_reading_list_as_json(self, storage_class):
-        storage = storage_class.return_value
-        storage.retrieve.return_value = []
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_as_html_embeds_readings(self, storage):
+        reading = readit.Reading(title='</script>', link='http://l/',
+                when=datetime.datetime.utcnow())
+        reading.object_id = '4fadcd174e02d83c8c000000'
+        storage.retrieve_version.return_value = (3, None)
+        storage.retrieve_page.return_value = ([reading], 'next-cursor')
+        self.load_session(session_key=self.session_key)
+        rv = self.client.get(self.get_session_url_for('/readings'), headers=[
+            ('Accept', 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8')])
+        self.assertEquals(rv.status_code, 200)
+        self.assertTrue(rv.is_streamed)
+        self.assertIn('document.initialReadings = {', rv.data)
+        self.assertIn(reading.object_id, rv.data)
+        self.assertIn('"\\u003c/script\\u003e"', rv.data)
+        self.assertIn('after=next-cursor', rv.data)
+        self.assertIn('"sync_token": "3"', rv.data)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_embedded_readings_are_retrieved_after_head(self, storage):
+        storage.retrieve_version.return_value = (3, None)
+        storage.retrieve_page.return_value = ([], None)
+        self.load_session(session_key=self.session_key)
+        rv = self.client.get(self.get_session_url_for('/readings'),
+                headers=[('Accept', 'text/html')], buffered=False)
+        chunks = iter(rv.response)
+        head = ''
+        while '</head>' not in head:
+            head += next(chunks)
+        self.assertFalse(storage.retrieve_page.called)
+        body = ''.join(chunks)
+        rv.close()
+        self.assertTrue(storage.retrieve_page.called)
+        self.assertIn('document.initialReadings', body)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_as_html_with_invalid_cursor(self, storage):
+        self.load_session(session_key=self.session_key)
+        rv = self.client.get(self.get_session_url_for('/readings?after=x'),
+                headers=[('Accept', 'text/html')])
+        self.assertEquals(rv.status_code, 400)
+        self.assertFalse(storage.retrieve_page.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_embedded_readings_fall_back_on_failure(self, storage):
+        storage.retrieve_version.return_value = (3, None)
+        storage.retrieve_page.side_effect = pymongo.errors.AutoReconnect()
+        self.load_session(session_key=self.session_key)
+        with mock.patch.object(readit.app.logger, 'exception'):
+            rv = self.client.get(self.get_session_url_for('/readings'),
+                    headers=[('Accept', 'text/html')])
+        self.assertEquals(rv.status_code, 200)
+        self.assertIn('document.initialReadings = null;', rv.data)
+        self.assertIn('</html>', rv.data)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_as_html_without_inline_readings(self, storage):
+        self.load_session(session_key=self.session_key)
+        with mock.patch.dict(readit.app.config, {'INLINE_READINGS': False}):
+            rv = self.client.get(self.get_session_url_for('/readings'),
+                    headers=[('Accept', 'text/html')])
+        self.assertEquals(rv.status_code, 200)
+        self.assertNotIn('document.initialReadings =', rv.data)
+        self.assertFalse(storage.retrieve_page.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_as_json(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        storage.retrieve_page.return_value = ([], None)
         self.load_session(session_key=self.session_key)
         rv = self.client.get(self.get_session_url_for('/readings'), headers=[
             ('Accept', 'application/json,text/javascript,*/*;q=0.1')])
         self.assertEquals(rv.status_code, 200)
         self.assertEquals(rv.mimetype, 'application/json')
+        self.assertNotIn('next', json.loads(rv.data))
 
-    @mock.patch(STORAGE_CLASS)
-    def test_retrieve_readings_from_storage(self, storage_class):
+    @mock.patch.object(readit.app, 'storage')
+    def test_retrieve_readings_from_storage(self, storage):
+        storage.retrieve_version.return_value = (0, None)
         reading_link = self.get_session_url_for('/readings')
         headers = [('Accept', 'application/json')]
-        storage = storage_class.return_value
         self.load_session(session_key=self.session_key, user_id='<UserId>')
         with readit.app.test_request_context(reading_link):
             readit.app.preprocess_request()
-            storage.retrieve.return_value = []
+            storage.retrieve_page.return_value = ([], None)
             self.client.get(reading_link, headers=headers)
-            storage.retrieve.assert_called_with('readings',
+            storage.retrieve_page.assert_called_with('readings',
+                    readit.app.config['READINGS_PAGE_SIZE'], after=None,
                     user_id='<UserId>', cls=readit.Reading)
 
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_includes_next_link(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        reading_link = self.get_session_url_for('/readings')
+        headers = [('Accept', 'application/json')]
+        storage.retrieve_page.return_value = ([], '<NextCursor>')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(reading_link, headers=headers)
+        self.assert_is_http_success(rsp)
+        next_link = json.loads(rsp.data)['next']
+        self.assertEquals(next_link['method'], 'GET')
+        self.assertEquals(next_link['url'],
+                reading_link + '?after=%3CNextCursor%3E')
+
+        rsp = self.client.get(next_link['url'], headers=headers)
+        self.assert_is_http_success(rsp)
+        positional, keywords = storage.retrieve_page.call_args
+        self.assertEquals(keywords['after'], '<NextCursor>')
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_rejects_invalid_cursor(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        storage.retrieve_page.side_effect = ValueError('invalid page cursor')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings?after=x'),
+                headers=[('Accept', 'application/json')])
+        self.assertEquals(rsp.status_code, 400)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_can_be_streamed(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        readings = [readit.Reading(title='Reading {0}'.format(index),
+                link='http://example.com/{0}'.format(index))
+                for index in xrange(3)]
+        storage.iter_retrieve.return_value = iter(readings)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings?stream=1'),
+                headers=[('Accept', 'application/json')])
+        self.assert_is_http_success(rsp)
+        self.assertEquals(rsp.mimetype, 'application/json')
+        result = json.loads(rsp.data)
+        self.assertEquals([r['title'] for r in result['readings']],
+                ['Reading 0', 'Reading 1', 'Reading 2'])
+        self.assertIn('actions', result)
+        self.assertNotIn('next', result)
+        self.assertFalse(storage.retrieve_page.called)
+        positional, keywords = storage.iter_retrieve.call_args
+        self.assertEquals(positional, ('readings',))
+        self.assertEquals(keywords['user_id'], '<UserId>')
+        self.assertEquals(keywords['batch_size'],
+                readit.app.config['READINGS_PAGE_SIZE'])
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_sends_validators(self, storage):
+        modified = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        storage.retrieve_version.return_value = (3, modified)
+        storage.retrieve_page.return_value = ([], None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings'),
+                headers=[('Accept', 'application/json')])
+        self.assert_is_http_success(rsp)
+        storage.retrieve_version.assert_called_with('versions', '<UserId>')
+        self.assertEquals(rsp.headers['ETag'], '"{0}"'.format(
+            self.readings_etag(3)))
+        self.assertEquals(rsp.last_modified, modified)
+        self.assertIn('accept', rsp.vary)
+        self.assertTrue(rsp.cache_control.no_cache)
+
+    def readings_etag(self, version):
+        with readit.app.test_request_context('/'):
+            return 'readings-{0}-{1}'.format(version,
+                    readit.app.links_digest)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_not_modified(self, storage):
+        storage.retrieve_version.return_value = (3, None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings'),
+                headers=[('Accept', 'application/json'),
+                         ('If-None-Match',
+                          '"{0}"'.format(self.readings_etag(3)))])
+        self.assertEquals(rsp.status_code, 304)
+        self.assertEquals(rsp.data, '')
+        self.assertFalse(storage.retrieve_page.called)
+        self.assertFalse(storage.iter_retrieve.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_modified(self, storage):
+        storage.retrieve_version.return_value = (4, None)
+        storage.retrieve_page.return_value = ([], None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings'),
+                headers=[('Accept', 'application/json'),
+                         ('If-None-Match',
+                          '"{0}"'.format(self.readings_etag(3)))])
+        self.assertEquals(rsp.status_code, 200)
+        self.assertEquals(rsp.headers['ETag'], '"{0}"'.format(
+            self.readings_etag(4)))
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_etag_depends_on_links(self, storage):
+        storage.retrieve_version.return_value = (3, None)
+        storage.retrieve_page.return_value = ([], None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for('/readings'),
+                headers=[('Accept', 'application/json'),
+                         ('If-None-Match',
+                          '"{0}"'.format(self.readings_etag(3)))],
+                base_url='http://localhost/app/')
+        self.assertEquals(rsp.status_code, 200)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_first_page_of_readings_is_cached(self, storage):
+        storage.retrieve_version.return_value = (3, None)
+        storage.retrieve_page.return_value = ([], '<NextCursor>')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        reading_link = self.get_session_url_for('/readings')
+        headers = [('Accept', 'application/json')]
+        hits = readit.app.readings_cache.hits
+        for _ in xrange(3):
+            rsp = self.client.get(reading_link, headers=headers)
+            self.assertIn('next', json.loads(rsp.data))
+        self.assertEquals(storage.retrieve_page.call_count, 1)
+        self.assertEquals(readit.app.readings_cache.hits, hits + 2)
+
+        storage.retrieve_version.return_value = (4, None)
+        self.client.get(reading_link, headers=headers)
+        self.assertEquals(storage.retrieve_page.call_count, 2)
+
+        self.client.get(reading_link + '?after=<Cursor>', headers=headers)
+        self.client.get(reading_link + '?after=<Cursor>', headers=headers)
+        self.assertEquals(storage.retrieve_page.call_count, 4)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_readings_cache_is_discarded_on_write(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        readit.app.readings_cache.put('<UserId>', ([], None), version=0)
+        rsp = self.client.post(self.get_session_url_for('/readings'),
+                data=json.dumps({'title': '<Title>', 'link': '<Link>'}),
+                content_type='application/json')
+        self.assert_is_http_success(rsp)
+        self.assertNotIn('<UserId>', readit.app.readings_cache)
+
+        readit.app.readings_cache.put('<UserId>', ([], None), version=1)
+        self.client.delete(self.get_session_url_for(
+            '/readings/4fadcd174e02d83c8c000000'))
+        self.assertNotIn('<UserId>', readit.app.readings_cache)
+
     @mock.patch('readit.User')
-    @mock.patch(STORAGE_CLASS)
-    def test_readings_retrieved_through_user(self, storage_class, user_class):
-        db = mock.Mock()
-        db.retrieve.return_value = [readit.Reading(title='<ShouldNotSeeThis>')]
-        storage_class.return_value = db
+    @mock.patch.object(readit.app, 'storage')
+    def test_readings_retrieved_through_user(self, storage, user_class):
+        storage.retrieve_version.return_value = (0, None)
+        storage.retrieve_page.return_value = (
+            [readit.Reading(title='<ShouldNotSeeThis>')], None)
 
         a_user = mock.Mock()
         a_user.readings = [readit.Reading(title='<ShouldSeeThis>')]
@@ -233,9 +469,8 @@ class ApplicationTests(ReaditTestCase):
                 '<ShouldSeeThis>')
 
 
-    @mock.patch(STORAGE_CLASS)
-    def test_add_json_reading(self, storage_class):
-        storage = storage_class.return_value
+    @mock.patch.object(readit.app, 'storage')
+    def test_add_json_reading(self, storage):
         self.load_session(session_key=self.session_key, user_id='<UserId>')
         reading_link = self.get_session_url_for('/readings')
         reading_obj = readit.Reading()
@@ -250,10 +485,44 @@ class ApplicationTests(ReaditTestCase):
                     content_type='application/json')
             self.assert_is_http_success(rsp)
             storage.save.assert_called_with('readings', reading_obj)
+            storage.increment_version.assert_called_once_with('versions',
+                    '<UserId>')
 
-    @mock.patch(STORAGE_CLASS)
-    def test_add_form_reading(self, storage_class):
-        storage = storage_class.return_value
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_is_saved_before_version_changes(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.post(self.get_session_url_for('/readings'),
+                data=json.dumps({'title': '<Title>', 'link': '<Link>'}),
+                content_type='application/json')
+        self.assert_is_http_success(rsp)
+        names = [name for (name, args, kwds) in storage.mock_calls
+                 if not name.startswith('__')]
+        self.assertEquals(names, ['save', 'increment_version',
+                'record_changes', 'prune_changes'])
+        new_reading = json.loads(rsp.data)['new_reading']
+        positional, keywords = storage.record_changes.call_args
+        self.assertEquals(keywords['added'], [new_reading['id']])
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_failed_flush_is_reported(self, storage):
+        storage.save.side_effect = pymongo.errors.OperationFailure('<Error>')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        with self.assertRaises(pymongo.errors.OperationFailure):
+            self.client.post(self.get_session_url_for('/readings'),
+                    data=json.dumps({'title': '<Title>', 'link': '<Link>'}),
+                    content_type='application/json')
+        self.assertFalse(storage.increment_version.called)
+
+    def test_error_responses_are_not_flushed(self):
+        with readit.app.test_request_context('/'):
+            flask.g.db = mock.Mock()
+            readit.flaskapp.flush_storage(flask.Response(status=404))
+            self.assertFalse(flask.g.db.flush.called)
+            readit.flaskapp.flush_storage(flask.Response(status=200))
+            flask.g.db.flush.assert_called_once_with()
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_add_form_reading(self, storage):
         self.load_session(session_key=self.session_key, user_id='<UserId>')
         reading_link = self.get_session_url_for('/readings')
         reading_obj = readit.Reading()
@@ -267,9 +536,54 @@ class ApplicationTests(ReaditTestCase):
             self.assert_is_http_success(rsp)
             storage.save.assert_called_with('readings', reading_obj)
 
-    @mock.patch(STORAGE_CLASS)
-    def test_remove_reading(self, storage_class):
-        storage = storage_class.return_value
+    @mock.patch.object(readit.app, 'storage')
+    def test_add_json_reading_list(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        readings = [{'title': '<Title{0}>'.format(index),
+                     'link': '<Link{0}>'.format(index)}
+                    for index in xrange(3)]
+
+        def save_many(storage_bin, storables):
+            return [(storables[1], Exception('<Failure>'))]
+        storage.save_many.side_effect = save_many
+
+        rsp = self.client.post(self.get_session_url_for('/readings'),
+                data=json.dumps(readings), content_type='application/json')
+
+        self.assert_is_http_success(rsp)
+        positional, keywords = storage.save_many.call_args
+        self.assertEquals(positional[0], 'readings')
+        self.assertEquals([r.title for r in positional[1]],
+                [r['title'] for r in readings])
+        data = json.loads(rsp.data)
+        self.assertEquals([r['title'] for r in data['new_readings']],
+                ['<Title0>', '<Title2>'])
+        self.assertEquals(data['failures'],
+                [{'index': 1, 'error': '<Failure>'}])
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_add_empty_json_reading_list(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.post(self.get_session_url_for('/readings'),
+                data='[]', content_type='application/json')
+        self.assert_is_http_success(rsp)
+        data = json.loads(rsp.data)
+        self.assertEquals((data['new_readings'], data['failures']), ([], []))
+        self.assertFalse(storage.save_many.called)
+        self.assertFalse(storage.increment_version.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_add_json_reading_list_validates_items(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        for readings in ([{'title': '<Title>'}], ['<NotAReading>']):
+            rsp = self.client.post(self.get_session_url_for('/readings'),
+                    data=json.dumps(readings),
+                    content_type='application/json')
+            self.assertEquals(rsp.status_code, 400)
+        self.assertFalse(storage.save_many.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_remove_reading(self, storage):
         self.load_session(session_key=self.session_key, user_id='<UserId>')
         reading_obj = readit.Reading()
         reading_obj.object_id = "123456abcdef"
@@ -282,37 +596,203 @@ class ApplicationTests(ReaditTestCase):
             readit.app.preprocess_request()
             rsp = self.client.delete(reading_link)
             self.assert_is_http_success(rsp)
-            storage.remove.assert_called_with('readings', '<UserId>',
-                    _id=reading_obj.object_id)
+            storage.remove.assert_called_with('readings',
+                    reading_obj.object_id, user_id='<UserId>')
+            storage.increment_version.assert_called_once_with('versions',
+                    '<UserId>')
+            storage.record_changes.assert_called_once_with('changes',
+                    '<UserId>', storage.increment_version.return_value,
+                    added=[], removed=[reading_obj.object_id])
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_remove_reading_discards_json_fragment(self, storage):
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        fragment_cache = readit.app.json_backend.fragment_cache
+        fragment_cache.put('123456abcdef', '"<CachedReading>"')
+        rsp = self.client.delete(self.get_session_url_for(
+            '/readings/123456abcdef'))
+        self.assert_is_http_success(rsp)
+        self.assertNotIn('123456abcdef', fragment_cache)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_list_uses_json_fragments(self, storage):
+        storage.retrieve_version.return_value = (0, None)
+        reading = readit.Reading(title='<Title>', link='<Link>')
+        reading.object_id = '<ReadingId>'
+        reading.user_id = '<UserId>'
+        storage.retrieve_page.return_value = ([reading], None)
+        fragment_cache = readit.app.json_backend.fragment_cache
+        fragment_cache.put('<ReadingId>', '"<CachedReading>"')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        try:
+            rsp = self.client.get(self.get_session_url_for('/readings'),
+                    headers=[('Accept', 'application/json')])
+            self.assertEquals(json.loads(rsp.data)['readings'],
+                    ['<CachedReading>'])
+        finally:
+            fragment_cache.discard('<ReadingId>')
+
+    @mock.patch.dict('os.environ', {'JSON_FRAGMENT_CACHE_SIZE': '0'})
+    def test_json_fragment_cache_can_be_disabled(self):
+        app = readit.app.__class__()
+        self.assertIsNone(app.json_backend.fragment_cache)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_remove_unknown_reading(self, storage):
+        storage.remove.side_effect = pymongo.errors.InvalidId('<Invalid>')
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.delete(self.get_session_url_for('/readings/x'))
+        self.assertEquals(rsp.status_code, 404)
+        self.assertFalse(storage.increment_version.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_changes(self, storage):
+        reading = readit.Reading(title='<Title>', link='<Link>')
+        reading.object_id = '<AddedId>'
+        storage.retrieve_version.return_value = (5, None)
+        storage.retrieve_changes.return_value = (['<AddedId>'],
+                ['<RemovedId>'], 5)
+        storage.retrieve.return_value = [reading]
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for(
+            '/readings/changes?since=3'))
+        self.assert_is_http_success(rsp)
+        result = json.loads(rsp.data)
+        self.assertEquals(result['sync_token'], '5')
+        self.assertEquals(result['removed'], ['<RemovedId>'])
+        self.assertEquals([r['title'] for r in result['readings']],
+                ['<Title>'])
+        storage.retrieve_changes.assert_called_with('changes', '<UserId>', 3)
+        positional, keywords = storage.retrieve.call_args
+        self.assertEquals(keywords['_id'], {'$in': ['<AddedId>']})
+        self.assertEquals(keywords['user_id'], '<UserId>')
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_changes_after_pruning_resyncs(self, storage):
+        storage.retrieve_version.return_value = (5, None)
+        storage.retrieve_changes.return_value = None
+        storage.retrieve_page.return_value = ([], None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.get(self.get_session_url_for(
+            '/readings/changes?since=1'))
+        self.assert_is_http_success(rsp)
+        result = json.loads(rsp.data)
+        self.assertTrue(result['resync'])
+        self.assertEquals(result['sync_token'], '5')
+        self.assertEquals(result['readings'], [])
+        self.assertNotIn('removed', result)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_removing_unknown_reading_is_not_recorded(self, storage):
+        storage.remove.return_value = 0
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        rsp = self.client.delete(self.get_session_url_for(
+            '/readings/' + str(ObjectId())))
+        self.assertEquals(rsp.status_code, 204)
+        self.assertFalse(storage.increment_version.called)
+        self.assertFalse(storage.record_changes.called)
+
+    @mock.patch.object(readit.app, 'storage')
+    def test_reading_changes_rejects_invalid_tokens(self, storage):
+        storage.retrieve_version.return_value = (5, None)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+        for query in ['', '?since=x', '?since=-1', '?since=6']:
+            rsp = self.client.get(self.get_session_url_for(
+                '/readings/changes' + query))
+            self.assertEquals(rsp.status_code, 400)
+        self.assertFalse(storage.retrieve_changes.called)
+
+    def test_inline_readings_configuration(self):
+        self.assertTrue(readit.app.config['INLINE_READINGS'])
+        with mock.patch.dict('os.environ', {'INLINE_READINGS': 'no'}):
+            app = readit.app.__class__()
+        self.assertFalse(app.config['INLINE_READINGS'])
+
+    @mock.patch.dict('os.environ', {'READINGS_CACHE_SIZE': '10',
+        'READINGS_CACHE_TTL': '2.5', 'USERS_CACHE_SIZE': '0'})
+    def test_cache_configuration(self):
+        app = readit.app.__class__()
+        self.assertIsInstance(app.readings_cache, readit.cache.LRUCache)
+        self.assertEqual(app.readings_cache.max_size, 10)
+        self.assertEqual(app.readings_cache.ttl, 2.5)
+        self.assertIsNone(app.users_cache)
+
+    def test_users_cache_expires_quickly(self):
+        self.assertEqual(readit.app.config['USERS_CACHE_TTL'], 30)
+        self.assertEqual(readit.app.users_cache.ttl, 30)
+
+    def test_shared_cache_selected_by_url(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.dict('os.environ',
+                {'CACHE_URL': 'file://' + directory}):
+            first, second = readit.app.__class__(), readit.app.__class__()
+        self.assertIsInstance(first.readings_cache, readit.cache.FileCache)
+        first.readings_cache.put('<UserId>', '<Readings>')
+        self.assertEquals(second.readings_cache.get('<UserId>'),
+                '<Readings>')
+        self.assertIsNone(second.users_cache.get('<UserId>'))
 
     @mock.patch(STORAGE_CLASS)
     @mock.patch.dict('os.environ', {'MONGOURL': '<MongoStorageUrl>'})
     def test_connection_string_comes_from_env(self, storage_class):
-        readit.app.load_configuration()
-        storage = storage_class.return_value
-        storage.retrieve.return_value = {'readings': {}}
-        self.load_session(session_key=self.session_key)
-        request_url = self.get_session_url_for('/readings')
-        with readit.app.test_request_context(request_url):
-            readit.app.preprocess_request()
-            self.client.get(request_url)
-            self.assertTrue(storage_class.called)
-            positional, keywords = storage_class.call_args
-            self.assertEqual(keywords['storage_url'], '<MongoStorageUrl>')
+        app = readit.app.__class__()
+        self.assertIs(app.storage, storage_class.return_value)
+        positional, keywords = storage_class.call_args
+        self.assertEqual(keywords['storage_url'], '<MongoStorageUrl>')
+
+    @mock.patch.dict('os.environ', {'STORAGE_URL': 'memory://app-tests'})
+    def test_memory_storage_selected_by_url(self):
+        app = readit.app.__class__()
+        self.assertIsInstance(app.storage, readit.memory.Storage)
+        self.assertEqual(app.storage.storage_url, 'memory://app-tests')
+
+    @mock.patch(STORAGE_CLASS)
+    @mock.patch.dict('os.environ', {'STORAGE_POOL_SIZE': '20',
+        'STORAGE_NETWORK_TIMEOUT': '2.5', 'STORAGE_CONNECT_TIMEOUT': '1'})
+    def test_connection_options_come_from_env(self, storage_class):
+        readit.app.__class__()
+        positional, keywords = storage_class.call_args
+        self.assertEqual(keywords['pool_size'], 20)
+        self.assertEqual(keywords['network_timeout'], 2.5)
+        self.assertEqual(keywords['connect_timeout'], 1.0)
 
     @mock.patch(STORAGE_CLASS)
     def test_storage_layer_passed_a_logger(self, storage_class):
-        readit.app.load_configuration()
-        storage = storage_class.return_value
-        storage.retrieve.return_value = {'readings': {}}
+        app = readit.app.__class__()
+        positional, keywords = storage_class.call_args
+        logger = keywords['logger']
+        self.assertIsInstance(logger, logging.Logger)
+        self.assertIs(logger.parent, app.logger)
+
+    @mock.patch(STORAGE_CLASS)
+    def test_storage_is_not_created_per_request(self, storage_class):
         self.load_session(session_key=self.session_key)
-        request_url = self.get_session_url_for('/readings')
-        with readit.app.test_request_context(request_url):
+        with readit.app.test_request_context('/'):
             readit.app.preprocess_request()
-            self.client.get(request_url)
-            self.assertTrue(storage_class.called)
-            positional, keywords = storage_class.call_args
-            logger = keywords['logger']
-            self.assertIsInstance(logger, logging.Logger)
-            self.assertIs(logger.parent, readit.app.logger)
-
+            self.assertIs(flask.g.db.storage, readit.app.storage)
+        self.assertFalse(storage_class.called)
+
+    def test_warm_up_pings_storage(self):
+        with mock.patch.object(readit.app, 'storage') as storage:
+            readit.app.warm_up()
+            storage.warm_up.assert_called_once_with()
+
+    def test_warm_up_failure_is_not_fatal(self):
+        with mock.patch.object(readit.app, 'storage') as storage:
+            storage.warm_up.side_effect = Exception('<ConnectionFailure>')
+            readit.app.warm_up()
+
+    @mock.patch.dict('os.environ', {'JSON_BACKEND': 'json'})
+    def test_json_backend_comes_from_env(self):
+        app = readit.app.__class__()
+        self.assertEqual(app.json_backend.name, 'json')
+
+    def test_json_backend_is_shared_by_requests(self):
+        with mock.patch.object(readit.app, 'json_backend') as json_backend:
+            json_backend.encode.return_value = '{}'
+            with readit.app.test_request_context('/'):
+                readit.app.jsonify({'first': 1})
+                readit.app.jsonify({'second': 2})
+            self.assertEqual(json_backend.encode.call_args_list,
+                    [(({'first': 1},), {}), (({'second': 2},), {})])
@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from .testing import TestCase
+
+import readit
+import readit.cache
+
+
+def _put_in_cache(directory, key, value):
+    readit.cache.FileCache(directory).put(key, value, version=1)
+
+
+class LRUCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = readit.cache.LRUCache(max_size=2, ttl=10,
+                clock=lambda: self.now)
+
+    def test_least_recently_used_value_is_evicted(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.get('a')
+        self.cache.put('c', 3)
+        self.assertEquals(len(self.cache), 2)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+
+    def test_values_expire(self):
+        self.cache.put('a', 1)
+        self.now += 9
+        self.assertEquals(self.cache.get('a'), 1)
+        self.now += 1
+        self.assertIsNone(self.cache.get('a'))
+        self.assertNotIn('a', self.cache)
+
+    def test_values_without_ttl_do_not_expire(self):
+        cache = readit.cache.LRUCache(clock=lambda: self.now)
+        cache.put('a', 1)
+        self.now += 10 ** 9
+        self.assertEquals(cache.get('a'), 1)
+
+    def test_version_must_match(self):
+        self.cache.put('a', 1, version=3)
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 1, version=3)
+        self.assertEquals(self.cache.get('a', version=3), 1)
+        self.assertIsNone(self.cache.get('a', version=4))
+
+    def test_discard_and_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.discard('a')
+        self.cache.discard('<Missing>')
+        self.assertNotIn('a', self.cache)
+        self.cache.clear()
+        self.assertEquals(len(self.cache), 0)
+
+    def test_hits_and_misses_are_counted(self):
+        self.cache.put('a', 1)
+        self.cache.get('a')
+        self.cache.get('a')
+        self.cache.get('b')
+        self.assertEquals(self.cache.stats(),
+                {'size': 1, 'max_size': 2, 'hits': 2, 'misses': 1})
+
+
+class FileCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = self.make_cache()
+
+    def make_cache(self, **kwds):
+        kwds.setdefault('ttl', 10)
+        return readit.cache.FileCache(self.directory, clock=lambda: self.now,
+                **kwds)
+
+    def test_values_are_shared(self):
+        reading = readit.Reading(title='<Title>', link='<Link>')
+        self.cache.put('<UserId>', [reading.to_persistence()], version=2)
+        other = self.make_cache()
+        value = other.get('<UserId>', version=2)
+        self.assertEquals(value[0]['title'], '<Title>')
+        self.assertEquals(value[0]['when'], reading.when)
+        self.assertEquals(other.stats()['hits'], 1)
+        self.assertEquals(self.cache.stats()['hits'], 0)
+
+    def test_invalidation_is_shared(self):
+        self.cache.put('a', 1)
+        self.make_cache().discard('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEquals(self.cache.misses, 1)
+
+    def test_values_from_other_processes_are_visible(self):
+        process = multiprocessing.Process(target=_put_in_cache,
+                args=(self.directory, 'a', '<Value>'))
+        process.start()
+        process.join()
+        self.assertEquals(self.cache.get('a', version=1), '<Value>')
+
+    def test_values_expire(self):
+        self.cache.put('a', 1)
+        self.now += 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertNotIn('a', self.cache)
+
+    def test_version_must_match(self):
+        self.cache.put('a', 1, version=3)
+        self.assertIsNone(self.cache.get('a', version=2))
+        self.assertEquals(self.cache.get('a', version=3), 1)
+
+    def test_older_versions_do_not_remove_newer_values(self):
+        self.make_cache().put('a', 1, version=4)
+        self.assertIsNone(self.cache.get('a', version=3))
+        self.assertIn('a', self.cache)
+
+    def test_non_ascii_keys(self):
+        self.cache.put('caf\xc3\xa9', 1)
+        self.cache.put(u'na\xefve', 2)
+        self.assertEquals(self.cache.get('caf\xc3\xa9'), 1)
+        self.assertEquals(self.cache.get(u'na\xefve'), 2)
+        self.assertEquals(self.cache.get('na\xc3\xafve'), 2)
+
+    def test_unreadable_values_are_misses(self):
+        self.cache.put('a', 1)
+        with open(self.cache._path_for('a'), 'wb') as entry_file:
+            entry_file.write('<NotJSON>')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertNotIn('a', self.cache)
+
+    def test_sweep_removes_least_recently_used(self):
+        cache = self.make_cache(max_size=2)
+        for index, key in enumerate(['a', 'b', 'c']):
+            cache.put(key, index)
+            os.utime(cache._path_for(key), (index, index))
+        cache.sweep()
+        self.assertEquals(len(cache), 2)
+        self.assertNotIn('a', cache)
+
+    def test_only_json_values_are_stored(self):
+        self.assertRaises(TypeError, self.cache.put, 'a', object())
+        self.assertNotIn('a', self.cache)
+        self.assertEquals(os.listdir(self.directory), [])
+
+    def test_directory_is_private(self):
+        directory = os.path.join(self.directory, 'private')
+        readit.cache.FileCache(directory)
+        self.assertEquals(os.stat(directory).st_mode & 0777, 0700)
+
+    def test_shared_directory_is_refused(self):
+        os.chmod(self.directory, 0777)
+        self.assertRaises(ValueError, readit.cache.FileCache, self.directory)
+
+    def test_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.clear()
+        self.assertEquals(len(self.cache), 0)
+
+
+class CreateCacheTests(TestCase):
+    def test_file_cache_per_name(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = readit.cache.create_cache('file://' + directory, 'users')
+        self.assertIsInstance(cache, readit.cache.FileCache)
+        self.assertEquals(cache.directory, os.path.join(directory, 'users'))
+        self.assertTrue(os.path.isdir(cache.directory))
+
+    def test_memory_is_the_default(self):
+        cache = readit.cache.create_cache(None, 'users', max_size=5, ttl=1)
+        self.assertIsInstance(cache, readit.cache.LRUCache)
+        self.assertEquals((cache.max_size, cache.ttl), (5, 1))
@@ -46,4 +46,8 @@ class AddReadingErrorTests(ReaditTestCase):
                 data='{"title":"<Title>"}', content_type='application/json')
         self.assertEquals(400, rsp.status_code)
 
-
+    def test_add_reading_with_invalid_when(self):
+        rsp = self.client.post(self.get_session_url_for('readings'),
+                data='{"title":"<Title>","link":"<Link>","when":"yesterday"}',
+                content_type='application/json')
+        self.assertEquals(400, rsp.status_code)
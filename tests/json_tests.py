@@ -1,7 +1,10 @@
 import datetime
+import inspect
 import pymongo.objectid
 
-from .testing import TestCase
+import mock
+
+from .testing import TestCase, make_reading
 
 import readit
 import readit.json_support
@@ -16,6 +19,11 @@ class CoordinateObject(object):
         return {'x': self.x, 'y': self.y}
 
 
+class Point(object):
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
 class JSONTests(TestCase):
     def setUp(self):
         self.encoder = readit.json_support.JSONEncoder()
@@ -75,3 +83,164 @@ class JSONTests(TestCase):
         self.assertEquals(value['when'], a_reading.when.isoformat() + 'Z')
         self.assertEquals(value['id'], str(a_reading.object_id))
 
+    def test_can_encode_is_asked_for_each_instance(self):
+        supporter = mock.Mock()
+        supporter.types = ()
+        supporter.can_encode.side_effect = lambda obj: obj.x % 2 == 0
+        supporter.encode.side_effect = lambda obj: [obj.x, obj.y]
+        self.encoder.add_encoder(supporter)
+        self.assertEquals(self.encoder.encode(Point(2, 2)), '[2, 2]')
+        with self.assertRaises(TypeError):
+            self.encoder.encode(Point(1, 1))
+        self.assertEquals(supporter.can_encode.call_count, 2)
+
+    def test_type_encoder_is_cached_by_class(self):
+        supporter = mock.Mock()
+        supporter.types = (Point,)
+        supporter.encode.side_effect = lambda obj: [obj.x, obj.y]
+        self.encoder.add_encoder(supporter)
+        with mock.patch('inspect.getmro', wraps=inspect.getmro) as getmro:
+            json_str = self.encoder.encode([Point(x, x) for x in xrange(10)])
+        self.assertEquals(self.decoder.decode(json_str)[9], [9, 9])
+        self.assertEquals(getmro.call_count, 1)
+
+    def test_encoders_are_changed_through_add_encoder(self):
+        supporter = mock.Mock()
+        supporter.types = ()
+        self.encoder.add_encoder(supporter)
+        self.assertIs(self.encoder.json_encoders[-1], supporter)
+
+    def test_changing_encoder_list_discards_cache(self):
+        first, second = mock.Mock(), mock.Mock()
+        first.types = second.types = (Point,)
+        first.encode.return_value = 'first'
+        second.encode.return_value = 'second'
+        self.encoder.json_encoders.append(first)
+        self.assertEquals(self.encoder.encode(Point(1, 1)), '"first"')
+        self.encoder.json_encoders.insert(0, second)
+        self.assertEquals(self.encoder.encode(Point(1, 1)), '"second"')
+        del self.encoder.json_encoders[0]
+        self.assertEquals(self.encoder.encode(Point(1, 1)), '"first"')
+        self.encoder.json_encoders = [second]
+        self.assertEquals(self.encoder.encode(Point(1, 1)), '"second"')
+
+    def test_encoder_registered_by_type(self):
+        supporter = mock.Mock()
+        supporter.types = (CoordinateObject,)
+        supporter.encode.return_value = 'coordinate'
+        self.encoder.add_encoder(supporter)
+        self.assertEquals(self.encoder.encode(CoordinateObject(1, 2)),
+                '"coordinate"')
+        self.assertFalse(supporter.can_encode.called)
+
+    def test_encoder_found_through_base_class(self):
+        class SpecialReading(readit.Reading):
+            __slots__ = ()
+        json_str = self.encoder.encode(SpecialReading('Title', 'Link'))
+        value = self.decoder.decode(json_str)
+        self.assertEquals(value['__class__'], 'readit.Reading')
+
+    def test_classic_classes_are_distinguished(self):
+        class Classic:
+            pass
+
+        class ClassicStorable:
+            object_id = None
+
+            def to_persistence(self):
+                return {'classic': True}
+        value = self.decoder.decode(self.encoder.encode(ClassicStorable()))
+        self.assertEquals(value['classic'], True)
+        with self.assertRaises(TypeError):
+            self.encoder.encode(Classic())
+
+
+class JSONBackendTests(TestCase):
+    def setUp(self):
+        self.decoder = readit.json_support.JSONDecoder()
+
+    def test_backend_encodes_custom_objects(self):
+        for module_name in ['json', 'simplejson']:
+            try:
+                backend = readit.json_support.create_backend(module_name)
+            except ImportError:
+                continue
+            item = CoordinateObject(1, 2)
+            result = self.decoder.decode(backend.encode([item]))
+            self.assertEquals(result[0]['id'], str(item.object_id))
+
+    def test_unknown_backend_raises(self):
+        with self.assertRaises(ImportError):
+            readit.json_support.create_backend('<NotAJsonModule>')
+
+    def test_list_is_encoded_in_chunks(self):
+        backend = readit.json_support.create_backend('json')
+        fragments = list(backend.iterencode_list(xrange(5), chunk_size=2))
+        self.assertEquals(fragments, ['[0, 1', ', 2, 3', ', 4', ']'])
+        self.assertEquals(list(backend.iterencode_list([])), ['[]'])
+
+    def test_object_is_streamed_with_list(self):
+        backend = readit.json_support.create_backend('json')
+        item = CoordinateObject(1, 2)
+        json_str = ''.join(backend.iterencode_object({'actions': []},
+                'items', iter([item, item]), chunk_size=1))
+        result = self.decoder.decode(json_str)
+        self.assertEquals(result['actions'], [])
+        self.assertEquals([i['x'] for i in result['items']], [1, 1])
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.cache = readit.json_support.FragmentCache(max_size=2)
+        self.backend = readit.json_support.create_backend('json',
+                fragment_cache=self.cache)
+        self.decoder = readit.json_support.JSONDecoder()
+
+    def test_fragments_are_reused(self):
+        reading = make_reading(object_id=pymongo.objectid.ObjectId())
+        first = ''.join(self.backend.iterencode_list([reading]))
+        self.assertIn(str(reading.object_id), self.cache)
+        reading.title = '<Changed>'
+        second = ''.join(self.backend.iterencode_list([reading]))
+        self.assertEquals(first, second)
+        self.assertEquals(self.decoder.decode(second)[0]['title'], '<Title0>')
+
+    def test_least_recently_used_fragment_is_evicted(self):
+        readings = [make_reading(index, object_id=pymongo.objectid.ObjectId())
+                    for index in xrange(3)]
+        self.backend.encode_fragment(readings[0])
+        self.backend.encode_fragment(readings[1])
+        self.backend.encode_fragment(readings[0])
+        self.backend.encode_fragment(readings[2])
+        self.assertEquals(len(self.cache), 2)
+        self.assertIn(str(readings[0].object_id), self.cache)
+        self.assertNotIn(str(readings[1].object_id), self.cache)
+
+    def test_discard_accepts_object_ids(self):
+        reading = make_reading(object_id=pymongo.objectid.ObjectId())
+        self.backend.encode_fragment(reading)
+        self.cache.discard(reading.object_id)
+        self.assertEquals(len(self.cache), 0)
+
+    def test_only_cacheable_types_are_cached(self):
+        item = CoordinateObject(1, 2)
+        result = ''.join(self.backend.iterencode_list([item, None]))
+        self.assertEquals(self.decoder.decode(result)[1], None)
+        self.assertEquals(len(self.cache), 0)
+
+    def test_unsaved_readings_are_not_cached(self):
+        self.backend.encode_fragment(readit.Reading(title='<Title>'))
+        self.assertEquals(len(self.cache), 0)
+
+    def test_partial_readings_are_not_cached(self):
+        object_id = pymongo.objectid.ObjectId()
+        partial = readit.Reading.from_partial_persistence(
+            {'title': '<Title>', 'link': '<Link>', 'user_id': '<UserId>'})
+        partial.object_id = object_id
+        fragment = self.backend.encode_fragment(partial)
+        self.assertIsNone(self.decoder.decode(fragment)['when'])
+        self.assertEquals(len(self.cache), 0)
+        fragment = self.backend.encode_fragment(
+            make_reading(object_id=object_id))
+        self.assertIsNotNone(self.decoder.decode(fragment)['when'])
+        self.assertIn(str(object_id), self.cache)
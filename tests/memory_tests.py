@@ -0,0 +1,229 @@
+import datetime
+import json
+import uuid
+
+import mock
+import pymongo
+import pymongo.errors
+from pymongo.objectid import ObjectId
+
+import readit
+import readit.memory
+
+from .testing import ReaditTestCase, TestCase, make_reading
+
+
+class MemoryStorageTests(TestCase):
+    def setUp(self):
+        super(MemoryStorageTests, self).setUp()
+        self.storage = readit.memory.Storage(
+            'memory://{0}'.format(uuid.uuid4()))
+
+    def test_storage_is_shared_by_url(self):
+        reading = make_reading(0)
+        self.storage.save('readings', reading)
+        other = readit.memory.Storage(self.storage.storage_url)
+        self.assertEquals(other.retrieve('readings', cls=readit.Reading),
+                [reading])
+
+    def test_save_and_retrieve(self):
+        reading = make_reading(0)
+        self.storage.save('readings', reading)
+        self.storage.save('readings', make_reading(1, '<OtherUser>'))
+        self.assertIsNotNone(reading.object_id)
+        result = self.storage.retrieve('readings', user_id='<UserId>',
+                cls=readit.Reading)
+        self.assertEquals(result, [reading])
+        self.assertEquals(result[0].object_id, reading.object_id)
+        self.assertEquals(result[0].when, reading.when)
+
+    def test_retrieve_by_storage_id(self):
+        readings = [make_reading(index) for index in xrange(3)]
+        self.storage.save_many('readings', readings)
+        result = self.storage.retrieve_one('readings',
+                storage_id=readings[1].object_id, cls=readit.Reading)
+        self.assertEquals(result, readings[1])
+
+    def test_retrieve_one_fails_for_multiple_results(self):
+        self.storage.save_many('readings',
+                [make_reading(index) for index in xrange(3)])
+        with self.assertRaises(readit.MoreThanOneResultError):
+            self.storage.retrieve_one('readings', user_id='<UserId>')
+
+    def test_sort_limit_skip_and_fields(self):
+        self.storage.save_many('readings',
+                [make_reading(index) for index in xrange(5)])
+        result = self.storage.retrieve('readings',
+                sort=[('when', pymongo.DESCENDING)], skip=1, limit=2,
+                fields=['title'])
+        self.assertEquals([r['title'] for r in result],
+                ['<Title3>', '<Title2>'])
+        self.assertEquals(sorted(result[0]), ['_id', 'title'])
+
+    def test_pages(self):
+        readings = [make_reading(index) for index in xrange(5)]
+        self.storage.save_many('readings', readings)
+        titles, cursor = [], None
+        while True:
+            page, cursor = self.storage.retrieve_page('readings', 2,
+                    after=cursor, user_id='<UserId>', cls=readit.Reading)
+            titles.append([r.title for r in page])
+            if cursor is None:
+                break
+        self.assertEquals(titles, [['<Title4>', '<Title3>'],
+                ['<Title2>', '<Title1>'], ['<Title0>']])
+
+    def test_remove(self):
+        reading = make_reading(0)
+        self.storage.save('readings', reading)
+        self.assertEquals(self.storage.remove('readings', reading.object_id,
+                user_id='<OtherUser>'), 0)
+        self.assertEquals(len(self.storage.retrieve('readings')), 1)
+        self.assertEquals(self.storage.remove('readings', reading.object_id,
+                user_id='<UserId>'), 1)
+        self.assertEquals(self.storage.retrieve('readings',
+                user_id='<UserId>'), [])
+
+    def test_pruned_changes_are_reported(self):
+        added = [str(ObjectId()) for _ in xrange(3)]
+        for version, object_id in enumerate(added, 1):
+            self.storage.record_changes('changes', '<UserId>', version,
+                    added=[object_id])
+        self.assertEquals(self.storage.prune_changes('changes', '<UserId>',
+                datetime.datetime.utcnow() + datetime.timedelta(seconds=1)),
+                3)
+        self.assertIsNone(
+            self.storage.retrieve_changes('changes', '<UserId>', 2))
+        self.assertEquals(
+            self.storage.retrieve_changes('changes', '<UserId>', 3),
+            ([], [], 3))
+
+    def test_unique_index_is_enforced(self):
+        first, second = readit.User(), readit.User()
+        first.email = second.email = '<Email>'
+        self.storage.save('users', first)
+        failures = self.storage.save_many('users', [second])
+        self.assertEquals(len(failures), 1)
+        self.assertIsInstance(failures[0][1],
+                pymongo.errors.DuplicateKeyError)
+        self.assertIsNone(second.object_id)
+
+    def test_equality_lookup_uses_index(self):
+        self.storage.save_many('readings',
+                [make_reading(index, str(index)) for index in xrange(5)])
+        collection = self.storage.get_mongo_connection()['readings']
+        with mock.patch('readit.memory._matches',
+                wraps=readit.memory._matches) as matcher:
+            self.assertEquals(len(self.storage.retrieve('readings',
+                    user_id='3')), 1)
+            self.assertEquals(matcher.call_count, 1)
+        self.assertIn('user_id', collection._indexes)
+
+    def test_versions(self):
+        self.assertEquals(self.storage.retrieve_version('versions', '<Id>'),
+                (0, None))
+        self.storage.increment_version('versions', '<Id>')
+        self.storage.increment_version('versions', '<Id>')
+        version, modified = self.storage.retrieve_version('versions', '<Id>')
+        self.assertEquals(version, 2)
+        self.assertIsInstance(modified, datetime.datetime)
+        self.assertEquals(self.storage.retrieve_version('versions', '<Other>'),
+                (0, None))
+
+    def test_warm_up(self):
+        self.storage.warm_up()
+
+
+class MemoryApplicationTests(ReaditTestCase):
+    def setUp(self):
+        super(MemoryApplicationTests, self).setUp()
+        self.storage = readit.memory.Storage(
+            'memory://{0}'.format(uuid.uuid4()))
+        patcher = mock.patch.object(readit.app, 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.load_session(session_key=self.session_key, user_id='<UserId>')
+
+    def test_add_and_list_readings(self):
+        readings_url = self.get_session_url_for('/readings')
+        for index in xrange(3):
+            rsp = self.client.post(readings_url,
+                    content_type='application/json',
+                    data=json.dumps({'title': '<Title{0}>'.format(index),
+                                     'link': '<Link{0}>'.format(index)}))
+            self.assert_is_http_success(rsp)
+        rsp = self.client.get(readings_url,
+                headers=[('Accept', 'application/json')])
+        self.assert_is_http_success(rsp)
+        titles = set(r['title'] for r in json.loads(rsp.data)['readings'])
+        self.assertEquals(titles, set(['<Title0>', '<Title1>', '<Title2>']))
+
+    def test_readings_etag_changes_on_write(self):
+        readings_url = self.get_session_url_for('/readings')
+        headers = [('Accept', 'application/json')]
+        first = self.client.get(readings_url, headers=headers)
+        rsp = self.client.get(readings_url, headers=headers + [
+            ('If-None-Match', first.headers['ETag'])])
+        self.assertEquals(rsp.status_code, 304)
+        self.client.post(readings_url, content_type='application/json',
+                data=json.dumps({'title': '<Title>', 'link': '<Link>'}))
+        rsp = self.client.get(readings_url, headers=headers + [
+            ('If-None-Match', first.headers['ETag'])])
+        self.assertEquals(rsp.status_code, 200)
+        self.assertNotEquals(rsp.headers['ETag'], first.headers['ETag'])
+
+    def test_reading_changes(self):
+        readings_url = self.get_session_url_for('/readings')
+        headers = [('Accept', 'application/json')]
+        new_ids = []
+        for index in xrange(2):
+            rsp = self.client.post(readings_url,
+                    content_type='application/json',
+                    data=json.dumps({'title': '<Title{0}>'.format(index),
+                                     'link': '<Link{0}>'.format(index)}))
+            new_ids.append(json.loads(rsp.data)['new_reading']['id'])
+        token = json.loads(self.client.get(readings_url,
+                headers=headers).data)['sync_token']
+        rsp = self.client.delete(
+            self.get_session_url_for('/readings/' + new_ids[0]))
+        self.assertEquals(rsp.status_code, 204)
+        self.client.post(readings_url, content_type='application/json',
+                data=json.dumps({'title': '<Title2>', 'link': '<Link2>'}))
+        rsp = self.client.get(self.get_session_url_for(
+            '/readings/changes?since=' + token))
+        self.assert_is_http_success(rsp)
+        changes = json.loads(rsp.data)
+        self.assertEquals([r['title'] for r in changes['readings']],
+                ['<Title2>'])
+        self.assertEquals(changes['removed'], [new_ids[0]])
+        rsp = self.client.get(self.get_session_url_for(
+            '/readings/changes?since=' + changes['sync_token']))
+        changes = json.loads(rsp.data)
+        self.assertEquals((changes['readings'], changes['removed']), ([], []))
+        titles = [r['title'] for r in json.loads(self.client.get(
+            readings_url, headers=headers).data)['readings']]
+        self.assertEquals(sorted(titles), ['<Title1>', '<Title2>'])
+
+    def test_changes_read_between_version_and_log_are_not_lost(self):
+        readings_url = self.get_session_url_for('/readings')
+        token = json.loads(self.client.get(readings_url,
+                headers=[('Accept', 'application/json')]).data)['sync_token']
+        record_changes = self.storage.record_changes
+        interleaved = []
+
+        def read_changes_first(*args, **kwds):
+            rsp = self.client.get(self.get_session_url_for(
+                '/readings/changes?since=' + token))
+            interleaved.append(json.loads(rsp.data))
+            return record_changes(*args, **kwds)
+
+        with mock.patch.object(self.storage, 'record_changes',
+                side_effect=read_changes_first):
+            self.client.post(readings_url, content_type='application/json',
+                    data=json.dumps({'title': '<Title>', 'link': '<Link>'}))
+        self.assertEquals(interleaved[0]['readings'], [])
+        self.assertEquals(interleaved[0]['sync_token'], token)
+        rsp = self.client.get(self.get_session_url_for(
+            '/readings/changes?since=' + interleaved[0]['sync_token']))
+        titles = [r['title'] for r in json.loads(rsp.data)['readings']]
+        self.assertEquals(titles, ['<Title>'])
@@ -1,3 +1,4 @@
+import datetime
 import warnings
 
 import readit.helpers
@@ -16,3 +17,36 @@ class MiscellaneousTests(TestCase):
             self.assertEquals(len(w), 1)
             self.assertTrue(issubclass(w[-1].category, DeprecationWarning))
 
+    def test_parse_iso8601(self):
+        expected = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        for value in ['2012-03-24T11:56:48', '2012-03-24T11:56:48Z',
+                      '2012-03-24 11:56:48z', '2012-03-24T13:56:48+02:00',
+                      '2012-03-24T06:26:48-0530', '2012-03-24T12:56:48+01',
+                      u'2012-03-24T11:56:48Z']:
+            self.assertEquals(readit.helpers.parse_iso8601(value), expected)
+
+    def test_parse_iso8601_fractional_seconds(self):
+        for value, microsecond in [('2012-03-24T11:56:48.5Z', 500000),
+                                   ('2012-03-24T11:56:48,123456789', 123456),
+                                   ('2012-03-24T11:56:48.000001+00:00', 1)]:
+            self.assertEquals(readit.helpers.parse_iso8601(value),
+                datetime.datetime(2012, 3, 24, 11, 56, 48, microsecond))
+
+    def test_parse_iso8601_crosses_day_boundary(self):
+        self.assertEquals(
+            readit.helpers.parse_iso8601('2012-03-24T23:30:00-01:00'),
+            datetime.datetime(2012, 3, 25, 0, 30, 0))
+
+    def test_parse_iso8601_rejects_invalid_values(self):
+        for value in ['', '2012-03-24', '2012/03/24T11:56:48',
+                      '2012-03-24T11:56:48.', '2012-03-24T11:56:48+2',
+                      '2012-03-24T11:56:48+02-00', '2012-03-24T11:56:48Q',
+                      '2012-13-24T11:56:48', '2012-03-24T11:56:48+-1:00',
+                      '2012-03-24T11:56:48+ 5:00', '2012-03-24T11:56:48+05:-1',
+                      '2012-03-24T11:56:48+5', '+012-03-24T11:56:48',
+                      '2012-03-24T 1:56:48', '2012-03-24T11:56:48+24:00',
+                      '2012-03-24T11:56:48+99:99', '2012-03-24T11:56:48-0560',
+                      '9999-12-31T23:59:59-01:00',
+                      '0001-01-01T00:00:00+01:00', None]:
+            with self.assertRaises(ValueError):
+                readit.helpers.parse_iso8601(value)
@@ -1,4 +1,8 @@
+import datetime
 import os
+
+import pymongo
+import pymongo.errors
 from pymongo.objectid import ObjectId
 
 import mock
@@ -18,6 +22,7 @@ CONNECTION_CLASS = 'pymongo.Connection'
 class TestStorable:
     def __init__(self, **attributes):
         self.object_id = None
+        self.partial = False
         self.attributes = attributes.copy()
 
     def to_persistence(self):
@@ -27,6 +32,12 @@ class TestStorable:
     def from_persistence(clazz, value_dict):
         return TestStorable(**value_dict)
 
+    @classmethod
+    def from_partial_persistence(clazz, value_dict):
+        instance = TestStorable(**value_dict)
+        instance.partial = True
+        return instance
+
 
 class MongoTestCase(TestCase):
     BIN_NAME = '<Bin>'
@@ -43,7 +54,7 @@ class MongoTestCase(TestCase):
 
     def tearDown(self):
         # ick ick ick
-        readit.mongo.Storage._CONN = None
+        readit.mongo.Storage._CONN_MANAGER = None
         self.cursor.reset_mock()
 
     def assertMongoCollectionWas(self, collection_name):
@@ -53,7 +64,11 @@ class MongoTestCase(TestCase):
         self.connection = mongo_connection_class_mock.return_value
         self.connection.readit = self.collection
 
-    def mongo_insert(self, persist_dict):
+    def mongo_insert(self, persist_dict, **options):
+        if isinstance(persist_dict, list):
+            for document in persist_dict:
+                self.mongo_insert(document)
+            return
         self.insert_call_args.append(persist_dict.copy())
         if '_id' not in persist_dict:
             persist_dict['_id'] = ObjectId()
@@ -92,6 +107,36 @@ class MongoConnectionTests(MongoTestCase):
                 cls=TestStorable)
         mongo_conn_class.assert_called_with(host='<MongoConnectionUrl>')
 
+    @mock.patch(CONNECTION_CLASS)
+    def test_connection_options(self, mongo_conn_class):
+        self.storage = readit.mongo.Storage(pool_size=25, network_timeout=5.0,
+                connect_timeout=2.5)
+        self.build_mongo_connection(mongo_conn_class)
+        self.storage.get_mongo_connection()
+        mongo_conn_class.assert_called_once_with(host=None, max_pool_size=25,
+                network_timeout=5.0, connectTimeoutMS=2500)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_connection_is_shared(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.storage.get_mongo_connection()
+        readit.mongo.Storage().get_mongo_connection()
+        self.assertEquals(mongo_conn_class.call_count, 1)
+
+    @mock.patch('os.getpid')
+    @mock.patch(CONNECTION_CLASS)
+    def test_reconnects_after_fork(self, mongo_conn_class, getpid):
+        getpid.return_value = 100
+        manager = readit.mongo.ConnectionManager()
+        parent_connection = manager.get_connection()
+        self.assertIs(manager.get_connection(), parent_connection)
+        getpid.return_value = 101
+        mongo_conn_class.return_value = mock.Mock()
+        child_connection = manager.get_connection()
+        self.assertIsNot(child_connection, parent_connection)
+        self.assertEquals(mongo_conn_class.call_count, 2)
+        self.assertFalse(parent_connection.disconnect.called)
+
 
 class MongoRetrieveTests(MongoTestCase):
     @mock.patch(CONNECTION_CLASS)
@@ -105,6 +150,34 @@ class MongoRetrieveTests(MongoTestCase):
         args['_id'] = ObjectId(self.storage_id)
         self.cursor.find.assert_called_with(args)
 
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_passes_sort_limit_and_skip(self, mongo_conn_class):
+        order = [('when', pymongo.DESCENDING)]
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        self.storage.retrieve(self.BIN_NAME, sort=order, limit=10, skip=20,
+                user_id='<UserId>')
+        self.cursor.find.assert_called_with({'user_id': '<UserId>'},
+                sort=order, limit=10, skip=20)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_passes_fields(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = [{'_id': ObjectId(), 'name': 'one'}]
+        result = self.storage.retrieve(self.BIN_NAME, fields=['name'],
+                cls=TestStorable, user_id='<UserId>')
+        self.cursor.find.assert_called_with({'user_id': '<UserId>'},
+                fields=['name'])
+        self.assertTrue(result[0].partial)
+        self.assertEquals(result[0].attributes['name'], 'one')
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_without_fields_is_not_partial(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = [{'_id': ObjectId(), 'name': 'one'}]
+        result = self.storage.retrieve(self.BIN_NAME, cls=TestStorable)
+        self.assertFalse(result[0].partial)
+
     @mock.patch(CONNECTION_CLASS)
     def test_retrieve_one_fails_for_multiple_results(self, mongo_conn_class):
         self.build_mongo_connection(mongo_conn_class)
@@ -134,6 +207,18 @@ class MongoRetrieveTests(MongoTestCase):
         self.assertEquals(result[1].object_id, str(second_object_id))
         self.assertEquals(result[1].attributes['name'], 'second object')
 
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_uses_bulk_factory(self, mongo_conn_class):
+        documents = [{'_id': ObjectId(), 'name': 'first object'}]
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = documents
+        cls = mock.Mock()
+        cls.from_persistence_many.return_value = mock.sentinel.objects
+        result = self.storage.retrieve(self.BIN_NAME, cls=cls)
+        self.assertIs(result, mock.sentinel.objects)
+        cls.from_persistence_many.assert_called_once_with(documents)
+        self.assertFalse(cls.from_persistence.called)
+
     @mock.patch(CONNECTION_CLASS)
     def test_retrieve_one_creates_class_instances(self, mongo_conn_class):
         oid = ObjectId()
@@ -142,10 +227,23 @@ class MongoRetrieveTests(MongoTestCase):
         result = self.storage.retrieve_one(self.BIN_NAME,
                 storage_id=self.storage_id, cls=TestStorable)
         self.assertMongoCollectionWas(self.BIN_NAME)
-        self.cursor.find.assert_called_with({'_id': ObjectId(self.storage_id)})
+        self.cursor.find.assert_called_with({'_id': ObjectId(self.storage_id)},
+                limit=2)
         self.assertEquals(result.object_id, str(oid))
         self.assertEquals(result.attributes['name'], 'value')
 
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_one_only_hydrates_one_object(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = [{'_id': ObjectId()},
+                                         {'_id': ObjectId()}]
+        with mock.patch.object(TestStorable, 'from_persistence') as factory:
+            with self.assertRaises(readit.MoreThanOneResultError):
+                self.storage.retrieve_one(self.BIN_NAME, cls=TestStorable,
+                        email='<Email>')
+            self.assertFalse(factory.called)
+        self.cursor.find.assert_called_with({'email': '<Email>'}, limit=2)
+
     @mock.patch(CONNECTION_CLASS)
     def test_retrieving_empty_lists(self, mongo_conn_class):
         self.build_mongo_connection(mongo_conn_class)
@@ -158,22 +256,254 @@ class MongoRetrieveTests(MongoTestCase):
         self.assertIsNone(result)
 
 
+class MongoIterRetrieveTests(MongoTestCase):
+    @mock.patch(CONNECTION_CLASS)
+    def test_iter_retrieve_is_lazy(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = [{'_id': ObjectId(), 'name': 'one'}]
+        values = self.storage.iter_retrieve(self.BIN_NAME, cls=TestStorable)
+        self.assertFalse(self.cursor.find.called)
+        result = list(values)
+        self.cursor.find.assert_called_with({})
+        self.assertEquals(len(result), 1)
+        self.assertEquals(result[0].attributes['name'], 'one')
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_iter_retrieve_hydrates_on_demand(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        documents = [{'_id': ObjectId(), 'name': 'one'},
+                     {'_id': ObjectId(), 'name': 'two'}]
+        self.cursor.find.return_value = documents
+        with mock.patch.object(TestStorable, 'from_persistence',
+                wraps=TestStorable.from_persistence) as from_persistence:
+            values = self.storage.iter_retrieve(self.BIN_NAME,
+                    cls=TestStorable)
+            first = next(values)
+            self.assertEquals(first.attributes['name'], 'one')
+            self.assertEquals(from_persistence.call_count, 1)
+            self.assertIn('_id', documents[1])
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_iter_retrieve_honors_batch_size(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        find_result = self.cursor.find.return_value
+        find_result.batch_size.return_value = [{'_id': ObjectId()}]
+        result = list(self.storage.iter_retrieve(self.BIN_NAME,
+                batch_size=500, user_id='<UserId>'))
+        self.cursor.find.assert_called_with({'user_id': '<UserId>'})
+        find_result.batch_size.assert_called_with(500)
+        self.assertEquals(len(result), 1)
+
+
+class MongoPageTests(MongoTestCase):
+    PAGE_ORDER = [('when', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]
+
+    def make_documents(self, count):
+        when = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        return [{'_id': ObjectId(), 'name': str(index),
+                 'when': when - datetime.timedelta(minutes=index)}
+                for index in xrange(count)]
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_first_page_is_limited_and_sorted(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        self.storage.retrieve_page(self.BIN_NAME, 10, user_id='<UserId>')
+        self.assertMongoCollectionWas(self.BIN_NAME)
+        self.cursor.find.assert_called_with({'user_id': '<UserId>'},
+                sort=self.PAGE_ORDER, limit=11)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_last_page_has_no_cursor(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        documents = self.make_documents(3)
+        first_object_id = documents[0]['_id']
+        self.cursor.find.return_value = documents
+        result, next_cursor = self.storage.retrieve_page(self.BIN_NAME, 3,
+                cls=TestStorable)
+        self.assertEquals(len(result), 3)
+        self.assertEquals(result[0].object_id, str(first_object_id))
+        self.assertIsNone(next_cursor)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_cursor_identifies_last_document(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        documents = self.make_documents(4)
+        last = documents[2]
+        self.cursor.find.return_value = documents
+        result, next_cursor = self.storage.retrieve_page(self.BIN_NAME, 3)
+        self.assertEquals(result, documents[:3])
+        self.assertEquals(next_cursor,
+                readit.mongo.make_page_cursor(last['when'], last['_id']))
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_cursor_continues_after_last_document(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        when = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        oid = ObjectId()
+        self.storage.retrieve_page(self.BIN_NAME, 10,
+                after=readit.mongo.make_page_cursor(when, oid),
+                user_id='<UserId>')
+        self.cursor.find.assert_called_with({'user_id': '<UserId>',
+                '$or': [{'when': {'$lt': when}},
+                        {'when': when, '_id': {'$lt': oid}}]},
+                sort=self.PAGE_ORDER, limit=11)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_page_fields_include_page_key(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        self.storage.retrieve_page(self.BIN_NAME, 10, fields=['title'])
+        self.cursor.find.assert_called_with({}, sort=self.PAGE_ORDER,
+                limit=11, fields=['title', 'when'])
+
+    def test_invalid_cursor(self):
+        for cursor in ['', 'not-a-cursor', '1332590208', '1332590208-xyz']:
+            with self.assertRaises(ValueError):
+                self.storage.retrieve_page(self.BIN_NAME, 10, after=cursor)
+
+
 class MongoRemoveTests(MongoTestCase):
     @mock.patch(CONNECTION_CLASS)
     def test_filtered_removal(self, mongo_conn_class):
         self.build_mongo_connection(mongo_conn_class)
-        self.storage.remove(self.BIN_NAME, self.storage_id, attribute='value')
+        self.cursor.remove.return_value = {'ok': 1.0, 'n': 0}
+        self.assertEquals(self.storage.remove(self.BIN_NAME, self.storage_id,
+                attribute='value'), 0)
         self.assertMongoCollectionWas(self.BIN_NAME)
         self.cursor.remove.assert_called_with({
-            'attribute': 'value', '_id': ObjectId(self.storage_id)})
+            'attribute': 'value', '_id': ObjectId(self.storage_id)},
+            safe=True)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_remove_many(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        other_id = str(ObjectId())
+        self.cursor.remove.return_value = {'ok': 1.0, 'n': 2}
+        self.assertEquals(self.storage.remove_many(self.BIN_NAME,
+                [self.storage_id, other_id], attribute='value'), 2)
+        self.assertMongoCollectionWas(self.BIN_NAME)
+        self.cursor.remove.assert_called_once_with({'attribute': 'value',
+            '_id': {'$in': [ObjectId(self.storage_id), ObjectId(other_id)]}},
+            safe=True)
 
     @mock.patch(CONNECTION_CLASS)
     def test_ignores_specified_objectids(self, mongo_conn_class):
         self.build_mongo_connection(mongo_conn_class)
-        self.storage.remove(self.BIN_NAME, self.storage_id)
+        self.cursor.remove.return_value = {'ok': 1.0, 'n': 1}
+        self.assertEquals(self.storage.remove(self.BIN_NAME,
+                self.storage_id), 1)
         self.assertMongoCollectionWas(self.BIN_NAME)
         self.cursor.remove.assert_called_with({
-            '_id': ObjectId(self.storage_id)})
+            '_id': ObjectId(self.storage_id)}, safe=True)
+
+
+class MongoVersionTests(MongoTestCase):
+    @mock.patch(CONNECTION_CLASS)
+    def test_increment_version_upserts_counter(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find_and_modify.return_value = {'_id': '<UserId>',
+                'version': 7, 'modified': datetime.datetime.utcnow()}
+        self.assertEquals(
+            self.storage.increment_version(self.BIN_NAME, '<UserId>'), 7)
+        self.assertMongoCollectionWas(self.BIN_NAME)
+        positional, keywords = self.cursor.find_and_modify.call_args
+        self.assertEquals(positional[0], {'_id': '<UserId>'})
+        self.assertEquals(positional[1]['$inc'], {'version': 1})
+        self.assertIn('modified', positional[1]['$set'])
+        self.assertTrue(keywords['upsert'])
+        self.assertTrue(keywords['new'])
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_version_of_unchanged_data(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        self.assertEquals(
+            self.storage.retrieve_version(self.BIN_NAME, '<UserId>'),
+            (0, None))
+        positional, keywords = self.cursor.find.call_args
+        self.assertEquals(positional, ({'_id': '<UserId>'},))
+
+
+class MongoChangeLogTests(MongoTestCase):
+    @mock.patch(CONNECTION_CLASS)
+    def test_record_changes_writes_tombstones(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        added, removed = ObjectId(), ObjectId()
+        self.storage.record_changes(self.BIN_NAME, '<UserId>', 3,
+                added=[added], removed=[str(removed)])
+        self.assertMongoCollectionWas(self.BIN_NAME)
+        positional, keywords = self.cursor.insert.call_args
+        self.assertTrue(keywords['safe'])
+        recorded = self.insert_call_args[0].pop('recorded')
+        self.assertIsInstance(recorded, datetime.datetime)
+        self.assertEquals(self.insert_call_args[1].pop('recorded'), recorded)
+        self.assertEquals(self.insert_call_args, [
+            {'version_id': '<UserId>', 'version': 3, 'object_id': added,
+             'removed': False},
+            {'version_id': '<UserId>', 'version': 3, 'object_id': removed,
+             'removed': True}])
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_record_nothing(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.storage.record_changes(self.BIN_NAME, '<UserId>', 3)
+        self.assertFalse(self.cursor.insert.called)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_changes_after_version(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        kept, dropped, removed = ObjectId(), ObjectId(), ObjectId()
+        self.cursor.find.return_value = [
+            {'object_id': kept, 'removed': False, 'version': 3},
+            {'object_id': dropped, 'removed': False, 'version': 3},
+            {'object_id': dropped, 'removed': True, 'version': 4},
+            {'object_id': removed, 'removed': True, 'version': 5}]
+        self.assertEquals(
+            self.storage.retrieve_changes(self.BIN_NAME, '<UserId>', 2),
+            ([kept], sorted([dropped, removed]), 5))
+        positional, keywords = self.cursor.find.call_args
+        self.assertEquals(positional[0],
+                {'version_id': '<UserId>', 'version': {'$gt': 2}})
+        self.assertEquals(keywords['sort'], [('version', pymongo.ASCENDING)])
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_retrieve_changes_after_horizon(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = [{'horizon': True},
+                {'object_id': ObjectId(), 'removed': False}]
+        self.assertIsNone(
+            self.storage.retrieve_changes(self.BIN_NAME, '<UserId>', 2))
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_prune_changes_writes_horizon_first(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        before = datetime.datetime.utcnow()
+        self.cursor.find.return_value = [{'version': 4}]
+        self.assertEquals(
+            self.storage.prune_changes(self.BIN_NAME, '<UserId>', before), 4)
+        expired = {'version_id': '<UserId>', 'recorded': {'$lt': before}}
+        positional, keywords = self.cursor.find.call_args
+        self.assertEquals(positional[0], expired)
+        self.assertEquals(keywords['sort'], [('version', pymongo.DESCENDING)])
+        horizon = self.insert_call_args[0]
+        self.assertEquals(horizon['version'], 4)
+        self.assertTrue(horizon['horizon'])
+        self.cursor.remove.assert_called_once_with({'version_id': '<UserId>',
+            'version': {'$lte': 4}, '_id': {'$ne': horizon['_id']}})
+        names = [name for name, args, kwds in self.cursor.mock_calls
+                 if name in ('insert', 'remove')]
+        self.assertEquals(names, ['insert', 'remove'])
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_prune_nothing(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.cursor.find.return_value = []
+        self.assertIsNone(self.storage.prune_changes(self.BIN_NAME,
+                '<UserId>', datetime.datetime.utcnow()))
+        self.assertFalse(self.cursor.insert.called)
+        self.assertFalse(self.cursor.remove.called)
 
 
 class MongoSaveTests(MongoTestCase):
@@ -185,6 +515,8 @@ class MongoSaveTests(MongoTestCase):
         self.assertMongoCollectionWas(self.BIN_NAME)
         self.assertEquals(self.insert_call_args, [{'attribute': 'value'}])
         self.assertIsNotNone(instance.object_id)
+        positional, keywords = self.cursor.insert.call_args
+        self.assertTrue(keywords['safe'])
 
     @mock.patch(CONNECTION_CLASS)
     def test_save_use_object_id(self, mongo_conn_class):
@@ -198,3 +530,60 @@ class MongoSaveTests(MongoTestCase):
         self.assertEquals(instance.object_id, self.storage_id)
 
 
+class MongoSaveManyTests(MongoTestCase):
+    @mock.patch(CONNECTION_CLASS)
+    def test_save_many_inserts_in_batches(self, mongo_conn_class):
+        instances = [TestStorable(index=index) for index in xrange(5)]
+        self.build_mongo_connection(mongo_conn_class)
+        failures = self.storage.save_many(self.BIN_NAME, instances,
+                batch_size=2)
+        self.assertEquals(failures, [])
+        self.assertMongoCollectionWas(self.BIN_NAME)
+        self.assertEquals(self.cursor.insert.call_count, 3)
+        for call in self.cursor.insert.call_args_list:
+            positional, keywords = call
+            self.assertIsInstance(positional[0], list)
+            self.assertTrue(keywords['safe'])
+        self.assertEquals(self.insert_call_args,
+                [{'index': index} for index in xrange(5)])
+        for instance in instances:
+            self.assertIsNotNone(instance.object_id)
+
+    @mock.patch(CONNECTION_CLASS)
+    def test_save_many_reports_failures(self, mongo_conn_class):
+        good, bad = TestStorable(name='good'), TestStorable(name='bad')
+        self.build_mongo_connection(mongo_conn_class)
+        saved_ids = []
+
+        def insert(documents, **options):
+            if isinstance(documents, list):
+                for document in documents:
+                    document['_id'] = ObjectId()
+                saved_ids.append(documents[0]['_id'])
+                raise pymongo.errors.OperationFailure('batch failed')
+            raise pymongo.errors.OperationFailure('duplicate')
+        self.cursor.insert.side_effect = insert
+        self.cursor.find.side_effect = lambda *args, **kwds: [
+            {'_id': saved_ids[0]}]
+
+        failures = self.storage.save_many(self.BIN_NAME, [good, bad])
+
+        self.assertEquals(good.object_id, str(saved_ids[0]))
+        self.assertIsNone(bad.object_id)
+        self.assertEquals(len(failures), 1)
+        self.assertIs(failures[0][0], bad)
+        self.assertIsInstance(failures[0][1], pymongo.errors.OperationFailure)
+
+
+class MongoIndexTests(MongoTestCase):
+    @mock.patch(CONNECTION_CLASS)
+    def test_ensure_indexes(self, mongo_conn_class):
+        self.build_mongo_connection(mongo_conn_class)
+        self.storage.ensure_indexes()
+        self.collection.__getitem__.assert_any_call('readings')
+        self.collection.__getitem__.assert_any_call('users')
+        self.cursor.ensure_index.assert_any_call(
+            [('user_id', pymongo.ASCENDING), ('when', pymongo.DESCENDING),
+             ('_id', pymongo.DESCENDING)], background=True)
+        self.cursor.ensure_index.assert_any_call(
+            [('email', pymongo.ASCENDING)], background=True, unique=True)
@@ -86,6 +86,111 @@ class ReadingTests(testing.TestCase):
         self.reading.user_id = None
         self.assertIsNone(self.reading.user_id)
 
+    def test_reading_is_compact(self):
+        self.assertFalse(hasattr(self.reading, '__dict__'))
+        with self.assertRaises(AttributeError):
+            self.reading.unknown_attribute = None
+
+    def test_from_persistence_many_matches_from_persistence(self):
+        documents = [{'_id': index, 'title': '<Title{0}>'.format(index),
+                      'link': '<Link>', 'user_id': '<UserId>',
+                      'when': self.instance_in_time}
+                     for index in xrange(3)]
+        documents.append({'_id': 3, 'title': '<Title3>', 'link': '<Link>',
+                          'user_id': '<UserId>',
+                          'when': self.truncated_instance})
+        readings = readit.Reading.from_persistence_many(documents)
+        self.assertEquals(len(readings), len(documents))
+        for reading, document in zip(readings, documents):
+            expected = readit.Reading.from_persistence(document)
+            self.assertEquals(reading, expected)
+            self.assertEquals(reading.when, self.truncated_instance)
+            self.assertEquals(reading.user_id, expected.user_id)
+            self.assertEquals(reading.object_id, str(document['_id']))
+
+    def test_from_persistence_many_requires_attributes(self):
+        with self.assertRaises(KeyError):
+            readit.Reading.from_persistence_many([
+                {'_id': 1, 'title': '<Title>', 'when': self.instance_in_time,
+                 'user_id': '<UserId>'}])
+
+    def test_from_partial_persistence(self):
+        reading = readit.Reading.from_partial_persistence({
+            'title': '<Title>', 'when': self.instance_in_time})
+        self.assertEquals(reading.title, '<Title>')
+        self.assertEquals(reading.when, self.truncated_instance)
+        self.assertIsNone(reading.link)
+        self.assertIsNone(reading.user_id)
+
+    def test_from_partial_persistence_without_when(self):
+        reading = readit.Reading.from_partial_persistence({'link': '<Link>'})
+        self.assertEquals(reading.link, '<Link>')
+        self.assertIsNone(reading.when)
+        self.assertIsNone(reading.to_persistence()['when'])
+
+
+class ReadingListTests(testing.TestCase):
+    def setUp(self):
+        super(ReadingListTests, self).setUp()
+        self.start = datetime.datetime(2012, 3, 24, 11, 56, 48)
+        self.readings = [
+            readit.Reading('<Title{0}>'.format(index), '<Link>',
+                self.start + datetime.timedelta(days=index))
+            for index in xrange(5)]
+        self.reading_list = readit.ReadingList()
+
+    def titles(self, readings):
+        return [r.title for r in readings]
+
+    def test_add_keeps_readings_ordered(self):
+        for index in [2, 0, 4, 1, 3]:
+            self.assertTrue(self.reading_list.add(self.readings[index]))
+        self.assertEquals(self.titles(self.reading_list),
+            ['<Title4>', '<Title3>', '<Title2>', '<Title1>', '<Title0>'])
+
+    def test_add_ignores_duplicates(self):
+        self.reading_list.add(self.readings[0])
+        duplicate = readit.Reading(self.readings[0].title,
+                self.readings[0].link, self.start + datetime.timedelta(1))
+        self.assertFalse(self.reading_list.add(duplicate))
+        self.assertEquals(len(self.reading_list), 1)
+        self.assertIs(list(self.reading_list)[0], self.readings[0])
+        self.assertIn(duplicate, self.reading_list)
+
+    def test_update_merges(self):
+        self.reading_list.update(self.readings[1::2])
+        self.reading_list.update(reversed(self.readings))
+        self.assertEquals(self.titles(self.reading_list),
+            ['<Title4>', '<Title3>', '<Title2>', '<Title1>', '<Title0>'])
+
+    def test_remove_uses_equality(self):
+        self.reading_list.update(self.readings)
+        self.reading_list.remove(readit.Reading('<Title2>', '<Link>'))
+        self.assertEquals(self.titles(self.reading_list),
+            ['<Title4>', '<Title3>', '<Title1>', '<Title0>'])
+        with self.assertRaises(KeyError):
+            self.reading_list.remove(self.readings[2])
+        self.reading_list.discard(self.readings[2])
+        self.assertEquals(len(self.reading_list), 4)
+
+    def test_newest(self):
+        self.reading_list.update(self.readings)
+        self.assertEquals(self.titles(self.reading_list.newest(2)),
+            ['<Title4>', '<Title3>'])
+        self.assertEquals(len(self.reading_list.newest(10)), 5)
+        self.assertEquals(self.reading_list.newest(0), [])
+
+    def test_between(self):
+        self.reading_list.update(self.readings)
+        self.assertEquals(self.titles(self.reading_list.between(
+                self.readings[1].when, self.readings[3].when)),
+            ['<Title2>', '<Title1>'])
+        self.assertEquals(self.titles(self.reading_list.between(
+                start=self.readings[3].when)), ['<Title4>', '<Title3>'])
+        self.assertEquals(self.titles(self.reading_list.between(
+                end=self.readings[1].when)), ['<Title0>'])
+
+
 class StorableProtocolTests(testing.StorableItemTestCase):
     StorableClass = readit.Reading
     REQUIRED_ATTRIBUTES = ['title', 'link', 'when', 'user_id']
@@ -1,7 +1,9 @@
 from __future__ import with_statement
 import json
 import urlparse
+import uuid
 
+import flask
 import mock
 
 import readit
@@ -57,3 +59,53 @@ class RoutingTests(ReaditTestCase):
         url = urlparse.urlparse(data['redirect_to'])
         self.assertEquals(self.links['get-readings']['url'], url.path)
 
+
+class LinkMapTests(ReaditTestCase):
+    def setUp(self):
+        super(LinkMapTests, self).setUp()
+        readit.app._link_tables.clear()
+
+    def get_links(self, session_key=None, **environ):
+        with readit.app.test_request_context('/', **environ):
+            readit.app.preprocess_request()
+            flask.g.user = readit.User(session_key)
+            return readit.app.links, dict(
+                (name, readit.app.build_link(name, session_key=session_key))
+                for name in readit.app.links)
+
+    def test_links_match_url_for(self):
+        for session_key in [self.session_key, 'needs quoting?']:
+            links, expected = self.get_links(session_key)
+            self.assertEquals(links['get-readings'],
+                    expected['get-readings'])
+            self.assertIn('get-readings-since', links)
+
+    def test_session_links_need_a_session(self):
+        links, expected = self.get_links()
+        self.assertNotIn('get-readings', links)
+        self.assertIn('start-login', links)
+
+    def test_urls_are_built_once(self):
+        with mock.patch('flask.url_for', wraps=flask.url_for) as url_for:
+            self.get_links(self.session_key)
+            call_count = url_for.call_count
+            links, expected = self.get_links(str(uuid.uuid4()))
+            links, expected = self.get_links(str(uuid.uuid4()))
+            self.assertEquals(url_for.call_count,
+                    call_count + 2 * len(expected))
+
+    def test_digest_depends_on_script_root(self):
+        digests = []
+        for base_url in ['http://localhost/', 'http://localhost/app/',
+                         'http://localhost/']:
+            with readit.app.test_request_context('/', base_url=base_url):
+                digests.append(readit.app.links_digest)
+        self.assertNotEquals(digests[0], digests[1])
+        self.assertEquals(digests[0], digests[2])
+
+    def test_links_are_compiled_per_script_root(self):
+        links, expected = self.get_links(self.session_key,
+                base_url='http://localhost/app/')
+        self.assertTrue(links['get-readings']['url'].startswith('/app/'))
+        links, expected = self.get_links(self.session_key)
+        self.assertFalse(links['get-readings']['url'].startswith('/app/'))
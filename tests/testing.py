@@ -145,6 +145,9 @@ class ReaditTestCase(HttpTestHelper):
         self.in_future = (datetime.datetime.utcnow() +
                 datetime.timedelta(days=1))
         self._link_map = None
+        for cache in [readit.app.readings_cache, readit.app.users_cache]:
+            if cache is not None:
+                cache.clear()
 
     def load_session(self, **sess_values):
         with self.client.session_transaction() as flask_sess:
@@ -227,6 +230,24 @@ class StorableItemTestCase(TestCase, object):
                 + 'implemented by ' + str(self.__class__))
 
 
+READING_EPOCH = datetime.datetime(2012, 3, 24, 11, 56, 48)
+
+
+def make_reading(index=0, user_id='<UserId>', object_id=None):
+    """Create a :py:class:`readit.Reading` fixture.
+
+    The title and link are derived from *index* and the reading was read
+    *index* minutes after :py:data:`READING_EPOCH`, so readings with
+    larger indices are more recent.
+    """
+    reading = readit.Reading(title='<Title{0}>'.format(index),
+            link='<Link{0}>'.format(index),
+            when=READING_EPOCH + datetime.timedelta(minutes=index))
+    reading.user_id = user_id
+    reading.object_id = object_id
+    return reading
+
+
 def skipped(f):
     """Make unittest skip the decorated function."""
     @functools.wraps(f)
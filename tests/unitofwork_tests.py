@@ -0,0 +1,176 @@
+import mock
+import pymongo.errors
+from pymongo.objectid import ObjectId
+
+from .testing import TestCase, make_reading
+
+import readit
+import readit.unitofwork
+
+
+class UnitOfWorkIdentityTests(TestCase):
+    def setUp(self):
+        self.storage = mock.Mock()
+        self.db = readit.unitofwork.UnitOfWork(self.storage)
+        self.object_id = str(ObjectId())
+
+    def test_repeated_loads_answer_the_same_instance(self):
+        self.storage.retrieve_one.side_effect = lambda *a, **kw: \
+                make_reading(object_id=self.object_id)
+        first = self.db.retrieve_one('readings', cls=readit.Reading,
+                _id=self.object_id)
+        second = self.db.retrieve_one('readings', cls=readit.Reading,
+                _id=self.object_id)
+        self.assertIs(first, second)
+
+    def test_page_members_are_shared(self):
+        self.storage.retrieve_page.side_effect = lambda *a, **kw: \
+                ([make_reading(object_id=self.object_id)], None)
+        first, cursor = self.db.retrieve_page('readings', 10,
+                cls=readit.Reading)
+        second, cursor = self.db.retrieve_page('readings', 10,
+                cls=readit.Reading)
+        self.assertIs(first[0], second[0])
+
+    def test_load_by_id_uses_identity_map(self):
+        self.storage.retrieve.return_value = [
+                make_reading(object_id=self.object_id)]
+        first = self.db.retrieve('readings', self.object_id,
+                cls=readit.Reading)
+        second = self.db.retrieve('readings', self.object_id,
+                cls=readit.Reading)
+        self.assertIs(first[0], second[0])
+        self.assertEquals(self.storage.retrieve.call_count, 1)
+
+    def test_partial_objects_are_not_recorded(self):
+        self.storage.retrieve.side_effect = lambda *a, **kw: \
+                [make_reading(object_id=self.object_id)]
+        partial = self.db.retrieve('readings', cls=readit.Reading,
+                fields=['title'])
+        whole = self.db.retrieve('readings', cls=readit.Reading)
+        self.assertIsNot(partial[0], whole[0])
+
+    def test_streamed_objects_are_not_recorded(self):
+        self.storage.iter_retrieve.side_effect = lambda *a, **kw: \
+                iter([make_reading(object_id=self.object_id)])
+        known = make_reading(object_id=str(ObjectId()))
+        self.db.save('readings', known)
+        self.storage.iter_retrieve.side_effect = lambda *a, **kw: iter([
+                make_reading(object_id=self.object_id),
+                make_reading(object_id=known.object_id)])
+        streamed = list(self.db.iter_retrieve('readings', cls=readit.Reading))
+        self.assertIs(streamed[1], known)
+        self.assertNotIn(('readings', self.object_id), self.db._identity_map)
+
+    def test_other_methods_are_passed_through(self):
+        self.db.warm_up()
+        self.storage.warm_up.assert_called_once_with()
+
+
+class UnitOfWorkWriteTests(TestCase):
+    def setUp(self):
+        self.storage = mock.Mock()
+        self.storage.save_many.return_value = []
+        self.db = readit.unitofwork.UnitOfWork(self.storage)
+
+    def test_saves_are_queued_until_flush(self):
+        reading = make_reading()
+        self.db.save('readings', reading)
+        self.assertIsNotNone(reading.object_id)
+        self.assertFalse(self.storage.save.called)
+        self.db.flush()
+        self.storage.save.assert_called_once_with('readings', reading)
+        self.db.flush()
+        self.assertEquals(self.storage.save.call_count, 1)
+
+    def test_saves_are_batched_per_collection(self):
+        readings = [make_reading() for _ in xrange(3)]
+        for reading in readings:
+            self.db.save('readings', reading)
+        self.db.flush()
+        self.storage.save_many.assert_called_once_with('readings', readings)
+        self.assertFalse(self.storage.save.called)
+
+    def test_failed_batch_is_raised(self):
+        readings = [make_reading() for _ in xrange(2)]
+        failure = pymongo.errors.DuplicateKeyError('<Duplicate>')
+        self.storage.save_many.return_value = [(readings[1], failure)]
+        for reading in readings:
+            self.db.save('readings', reading)
+        with self.assertRaises(pymongo.errors.DuplicateKeyError):
+            self.db.flush()
+
+    def test_removes_are_batched_per_constraint(self):
+        object_ids = [str(ObjectId()) for _ in xrange(3)]
+        self.storage.retrieve.return_value = [{'_id': ObjectId(object_id)}
+                                              for object_id in object_ids[:2]]
+        for object_id in object_ids[:2]:
+            self.db.remove('readings', object_id, user_id='<UserId>')
+        self.db.remove('readings', object_ids[2], user_id='<OtherUser>')
+        self.assertFalse(self.storage.remove.called)
+        self.db.flush()
+        self.storage.remove_many.assert_called_once_with('readings',
+                object_ids[:2], user_id='<UserId>')
+        self.storage.remove.assert_called_once_with('readings',
+                object_ids[2], user_id='<OtherUser>')
+
+    def test_only_matching_removals_are_written(self):
+        object_ids = [str(ObjectId()) for _ in xrange(3)]
+        self.storage.retrieve.return_value = [{'_id': ObjectId(object_ids[1])}]
+        self.storage.remove.return_value = 0
+        written = []
+        self.db.after_flush(lambda: written.extend(
+            self.db.was_written('readings', object_id)
+            for object_id in object_ids))
+        for object_id in object_ids[:2]:
+            self.db.remove('readings', object_id, user_id='<UserId>')
+        self.db.remove('readings', object_ids[2], user_id='<OtherUser>')
+        self.db.flush()
+        self.assertEquals(written, [False, True, False])
+        self.storage.remove_many.assert_called_once_with('readings',
+                [object_ids[1]], user_id='<UserId>')
+
+    def test_invalid_ids_are_rejected_immediately(self):
+        with self.assertRaises(pymongo.errors.InvalidId):
+            self.db.remove('readings', '<NotAnObjectId>')
+
+    def test_removed_objects_leave_identity_map(self):
+        reading = make_reading()
+        self.db.save('readings', reading)
+        self.db.remove('readings', reading.object_id)
+        self.storage.retrieve.return_value = []
+        self.assertEquals(self.db.retrieve('readings', reading.object_id,
+                cls=readit.Reading), [])
+
+    def test_callbacks_run_after_writes(self):
+        calls = []
+        self.storage.save.side_effect = lambda *args: calls.append('save')
+        self.db.save('readings', make_reading())
+        self.db.after_flush(calls.append, '<Callback>')
+        self.assertEquals(calls, [])
+        self.db.flush()
+        self.assertEquals(calls, ['save', '<Callback>'])
+
+    def test_callbacks_run_after_failed_writes(self):
+        readings = [make_reading() for _ in xrange(2)]
+        failure = pymongo.errors.DuplicateKeyError('<Duplicate>')
+        self.storage.save_many.return_value = [(readings[1], failure)]
+        for reading in readings:
+            self.db.save('readings', reading)
+        written = []
+        self.db.after_flush(lambda: written.extend(
+            self.db.was_written('readings', r.object_id) for r in readings))
+        with self.assertRaises(pymongo.errors.DuplicateKeyError):
+            self.db.flush()
+        self.assertEquals(written, [True, False])
+        self.assertFalse(self.db.was_written('readings',
+                readings[0].object_id))
+
+    def test_save_many_flushes_queued_writes_first(self):
+        calls = []
+        self.storage.save.side_effect = lambda *args: calls.append('save')
+        self.storage.save_many.side_effect = (
+                lambda *args: calls.append('save_many') or [])
+        self.db.save('readings', make_reading())
+        self.db.save_many('readings', [make_reading()])
+        self.assertEquals(calls, ['save', 'save_many'])
@@ -115,6 +115,14 @@ class UserTests(testing.TestCase):
             ['title 2', 'title 3', 'title 1']
         )
 
+    def test_user_is_compact(self):
+        self.assertFalse(hasattr(self.user, '__dict__'))
+
+    def test_from_partial_persistence(self):
+        a_user = readit.User.from_partial_persistence({'email': '<Email>'})
+        self.assertEquals(a_user.email, '<Email>')
+        self.assertIsNone(a_user.display_name)
+
 
 class StorableProtocolTests(testing.StorableItemTestCase):
     StorableClass = readit.User
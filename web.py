@@ -13,5 +13,6 @@ if __name__ == '__main__':
         def send_javascript(filename):
             return flask.send_from_directory(javascript_dir, filename)
 
+        readit.flaskapp.app.warm_up()
         readit.flaskapp.app.run(debug=True, host='0.0.0.0')
 